@@ -1,22 +1,309 @@
 import argparse
+import json
+import multiprocessing
 import os
+import queue
+import shutil
 import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 from config import *
 from preprocess.preprocess import preprocess_pkl_file
+from preprocess.cache import manifest_path
+from preprocess.store import INTERMEDIATE_FORMATS, get_intermediate_path, load_intermediate
+from preprocess.device import DEVICE_CHOICES
+from jobs import JobPool, forward_output, run_jobs
+from render.client import LISTENING_PATTERN, shutdown_server
 
-def render_sequence(script: str, data_path: str, video_path: str, option_cmd: List[str]) -> None:
+def blender_command(script: str, data_path: str, video_paths: List[str], option_cmd: List[str], blend_path: str = BLENDER_PATH) -> List[str]:
+    """Command line running `script` in a headless Blender on `blend_path`, one video path per render mode."""
+    option_cmd = option_cmd + ["-i", str(data_path), "-o", *map(str, video_paths)]
+    return ["blender", str(blend_path), "--background", "--python", script, "--", *option_cmd]
+
+def client_command(ports: List[int], data_path: str, video_paths: List[str], option_cmd: List[str]) -> List[str]:
+    """Command line sending a render.py job to the first idle render server of `ports`."""
+    option_cmd = option_cmd + ["-i", str(data_path), "-o", *map(str, video_paths)]
+    return [sys.executable, RENDER_CLIENT_SCRIPT_PATH, "-p", *map(str, ports), "--", *option_cmd]
+
+def report_server_port(ports: "queue.Queue[int]", line: str) -> None:
+    """Output line handler of a render server, queues the port it listens on."""
+    match = LISTENING_PATTERN.search(line)
+    if match:
+        ports.put(int(match.group(2)))
+
+def wait_for_server_port(ports: "queue.Queue[int]", process: subprocess.Popen, timeout: float = 300) -> int:
+    """Port a render server reported it listens on, raises if it exits before."""
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            return ports.get(timeout=0.5)
+        except queue.Empty:
+            if process.poll() is not None:
+                raise RuntimeError(f"Render server exited with code {process.returncode}")
+    raise TimeoutError(f"Render server did not start in {timeout}s")
+
+def start_render_servers(count: int, blend_path: str = BLENDER_PATH) -> Tuple[List[int], List[subprocess.Popen]]:
+    """
+    Start `count` Blender render servers on `blend_path`, their output is merged into stdout.
+    Servers bind free ports and print them, so they never reach a server of another run.
+    """
+    processes, port_queues = [], []
+    lock = threading.Lock()
+    for i in range(count):
+        cmd = ["blender", str(blend_path), "--background", "--python", RENDER_SERVER_SCRIPT_PATH, "--", "-p", "0"]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        port_queue = queue.Queue()
+        on_line = partial(report_server_port, port_queue)
+        threading.Thread(target=forward_output, args=(process, f"server{i}", lock, on_line), daemon=True).start()
+        processes.append(process)
+        port_queues.append(port_queue)
+    ports = []
+    try:
+        for port_queue, process in zip(port_queues, processes):
+            ports.append(wait_for_server_port(port_queue, process))
+    except BaseException:
+        stop_render_servers(ports, processes, graceful=False)
+        raise
+    return ports, processes
+
+def stop_render_servers(ports: List[int], processes: List[subprocess.Popen], graceful: bool = True) -> None:
+    """
+    Shut down the render servers, the ones that have not reported their port yet are terminated.
+    Without `graceful`, e.g. after a failed run, servers may still be rendering and are all terminated.
+    """
+    for i, process in enumerate(processes):
+        if process.poll() is not None:
+            continue
+        if graceful and i < len(ports):
+            try:
+                shutdown_server(ports[i])
+                process.wait(timeout=60)
+                continue
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        process.terminate()
+        process.wait()
+
+def render_sequence(cmd: List[str]) -> None:
     """Render a sequence using Blender."""
-    option_cmd.extend(["-i", str(data_path), "-o", str(video_path)])
-    cmd = ["blender", BLENDER_PATH, "--background", "--python", script, "--", *option_cmd]
     env = os.environ.copy()
     subprocess.run(cmd, check=True, env=env)
 
+def get_anim_frames(num_frames: int, upsample: int = 2) -> int:
+    """Animation frames render.py sets for `num_frames` input frames, `upsample` animation frames apart."""
+    return (num_frames - 1) * upsample + 1
+
+def get_frame_ranges(num_frames: int, frame_chunk: int) -> List[Tuple[int, int]]:
+    """Split animation frames 1..`num_frames` into shards of `frame_chunk` frames."""
+    return [(start, min(start + frame_chunk - 1, num_frames)) for start in range(1, num_frames + 1, frame_chunk)]
+
+def encode_command(frames_dir: Path, video_file: Path, num_frames: int) -> List[str]:
+    """Command line encoding the PNG frames rendered by all shards of a camera into one video."""
+    return [sys.executable, ENCODE_SCRIPT_PATH, str(frames_dir), str(video_file), str(num_frames), "--fps", str(FRAME_RATE)]
+
+def get_frames_dir(video_path: Path, camera: int) -> Path:
+    """PNG frames rendered by the shards of a camera, see render.utils.get_frames_dir."""
+    return Path(f"{video_path}_cam{camera:02d}_frames")
+
+def get_job_name(video_path: Path) -> str:
+    """Log prefix of the jobs rendering `video_path`, e.g. sample/eevee_sc0_output"""
+    video_path = Path(video_path)
+    return f"{video_path.parent.name}/{video_path.name}"
+
+def get_shards(video_path: Path, groups: List[List[int]], frame_ranges: Optional[List[Tuple[int, int]]] = None) -> List[Tuple[List[int], Optional[Tuple[int, int]], str, List[str]]]:
+    """(cameras, frame_range, job name, render.py options) of every camera group and frame shard of a pass."""
+    shards = []
+    for group in groups:
+        for frame_range in frame_ranges or [None]:
+            name = get_job_name(video_path) + "_" + "_".join(f"cam{camera:02d}" for camera in group)
+            cmd = []
+            if frame_range:
+                cmd = ["-fs", str(frame_range[0]), "-fe", str(frame_range[1])]
+                name += f"_f{frame_range[0]:04d}-{frame_range[1]:04d}"
+            shards.append((group, frame_range, name, cmd))
+    return shards
+
+def get_blend_path(video_path: Path) -> Path:
+    """Scene of a pass saved by its build job for the workers, removed once the pass is rendered."""
+    return Path(f"{video_path}.blend")
+
+def plan_passes(script: str, data_path: str, passes: List[Tuple[str, Path]], option_cmd: List[str], cameras: List[int], max_jobs: int = 1, cameras_per_job: int = 1, frame_ranges: Optional[List[Tuple[int, int]]] = None, server_ports: Optional[List[int]] = None) -> List[List[Tuple[str, List[str]]]]:
+    """
+    Blender jobs rendering the (mode, video_path) `passes`, as stages of (name, command)
+    that only depend on the previous stages.
+    With a single job, one Blender process builds and renders the modes back to back.
+    Otherwise passes run concurrently, at most `max_jobs` Blender processes at a time.
+    With several camera groups or `frame_ranges` shards, each pass is built once and
+    saved next to its videos, then rendered from `cameras_per_job` cameras per worker,
+    one worker per shard. Shards are rendered to PNG frames, encoded by a final stage
+    of one ffmpeg job per pass and camera.
+    With `server_ports`, jobs are sent to render servers which keep scene.blend loaded,
+    so every camera group and shard builds its own scene instead of loading a saved one.
+    """
+    groups = [cameras[i:i + cameras_per_job] for i in range(0, len(cameras), cameras_per_job)]
+    encodes = [plan_encodes(passes, cameras, frame_ranges)] if frame_ranges else []
+    if server_ports:
+        jobs = []
+        for mode, video_path in passes:
+            for group, frame_range, name, shard_cmd in get_shards(video_path, groups, frame_ranges):
+                jobs.append((name, client_command(server_ports, data_path, [video_path], option_cmd + ["-m", mode, "-c", *map(str, group)] + shard_cmd)))
+        return [jobs] + encodes
+    
+    if max_jobs <= 1 and not frame_ranges:
+        name = "_".join([get_job_name(passes[0][1])] + [mode for mode, _ in passes[1:]])
+        return [[(name, blender_command(script, data_path, [video_path for _, video_path in passes], option_cmd + ["-m", *[mode for mode, _ in passes]]))]]
+    
+    names = [get_job_name(video_path) for _, video_path in passes]
+    if len(groups) == 1 and not frame_ranges:
+        return [[
+            (name, blender_command(script, data_path, [video_path], option_cmd + ["-m", mode]))
+            for name, (mode, video_path) in zip(names, passes)
+        ]]
+    
+    builds, workers = [], []
+    for name, (mode, video_path) in zip(names, passes):
+        blend_path = get_blend_path(video_path)
+        builds.append((name, blender_command(script, data_path, [video_path], option_cmd + ["-m", mode, "-sb", str(blend_path)])))
+        for group, frame_range, worker_name, shard_cmd in get_shards(video_path, groups, frame_ranges):
+            cmd = option_cmd + ["-m", mode, "-pb", "-c", *map(str, group)] + shard_cmd
+            workers.append((worker_name, blender_command(script, data_path, [video_path], cmd, str(blend_path))))
+    return [builds, workers] + encodes
+
+def plan_encodes(passes: List[Tuple[str, Path]], cameras: List[int], frame_ranges: List[Tuple[int, int]]) -> List[Tuple[str, List[str]]]:
+    """Stage encoding the PNG frames rendered by the shards of every pass and camera into one video each."""
+    num_frames = frame_ranges[-1][1]
+    return [
+        (f"{get_job_name(video_path)}_cam{camera:02d}_encode", encode_command(get_frames_dir(video_path, camera), video_file, num_frames))
+        for _, video_path in passes
+        for camera, video_file in zip(cameras, get_video_files(video_path, cameras, num_frames))
+    ]
+
+def get_options_path(video_path: Path) -> Path:
+    """render.py options the videos of a pass were rendered with, written once the pass is done."""
+    return Path(f"{video_path}_options.json")
+
+def read_render_options(video_path: Path) -> Optional[List[str]]:
+    try:
+        with open(get_options_path(video_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def prepare_passes(passes: List[Tuple[str, Path]], cameras: List[int], frame_ranges: Optional[List[Tuple[int, int]]] = None) -> None:
+    """Clear what earlier runs left for `passes`, right before their jobs are started."""
+    for _, video_path in passes:
+        Path(video_path).parent.mkdir(parents=True, exist_ok=True)
+        # Written again once the pass is rendered, an aborted pass is not up to date
+        get_options_path(video_path).unlink(missing_ok=True)
+        if frame_ranges:
+            # Frames left by an aborted run would be encoded with the new ones
+            for camera in cameras:
+                shutil.rmtree(get_frames_dir(video_path, camera), ignore_errors=True)
+
+def finish_passes(passes: List[Tuple[str, Path]], option_cmd: List[str]) -> None:
+    """Record the options of rendered `passes` and remove the scenes saved for their workers."""
+    for _, video_path in passes:
+        with open(get_options_path(video_path), "w") as f:
+            json.dump(option_cmd, f)
+        get_blend_path(video_path).unlink(missing_ok=True)
+
+def render_passes(script: str, data_path: str, passes: List[Tuple[str, Path]], option_cmd: List[str], cameras: List[int], max_jobs: int = 1, cameras_per_job: int = 1, frame_ranges: Optional[List[Tuple[int, int]]] = None, server_ports: Optional[List[int]] = None) -> None:
+    """Render the (mode, video_path) `passes`, see `plan_passes`."""
+    stages = plan_passes(script, data_path, passes, option_cmd, cameras, max_jobs, cameras_per_job, frame_ranges, server_ports)
+    prepare_passes(passes, cameras, frame_ranges)
+    if len(stages) == 1 and len(stages[0]) == 1 and not server_ports:
+        # A single Blender process prints straight to the terminal
+        render_sequence(stages[0][0][1])
+    else:
+        for stage in stages:
+            run_jobs([command for _, command in stage], max_jobs, [name for name, _ in stage])
+    finish_passes(passes, option_cmd)
+
+def get_video_files(video_path: Path, cameras: List[int], num_frames: int, frame_no: Optional[int] = None) -> List[Path]:
+    """
+    Files Blender writes for `video_path` from `cameras`: videos of the `num_frames`
+    animation frames, or stills of input frame `frame_no`.
+    """
+    if frame_no:
+        return [Path(f"{video_path}_cam{camera:02d}_f{frame_no:04d}.png") for camera in cameras]
+    return [Path(f"{video_path}_cam{camera:02d}0001-{num_frames:04d}.mp4") for camera in cameras]
+
+def is_up_to_date(files: List[Path], source: Path) -> bool:
+    """All `files` exist and were written after `source`."""
+    return all(path.exists() and path.stat().st_mtime >= source.stat().st_mtime for path in files)
+
+def find_pkl_files(input_dir: Path) -> List[Path]:
+    """.pkl files under `input_dir`, named uniquely since outputs are stored by file name."""
+    pkl_paths = sorted(input_dir.rglob("*.pkl"))
+    stems = [path.stem for path in pkl_paths]
+    duplicates = sorted(set(stem for stem in stems if stems.count(stem) > 1))
+    if duplicates:
+        raise ValueError(f"{input_dir} has several .pkl files named {', '.join(duplicates)}")
+    return pkl_paths
+
+def render_batch(files: List[Tuple[Path, Path, List[Tuple[str, Path]]]], preprocess_kwargs: dict, option_cmd: List[str], cameras: List[int], frame_no: Optional[int], frame_chunk: int, max_jobs: int = 1, cameras_per_job: int = 1, preprocess_jobs: int = 1, force_render: bool = False, server_ports: Optional[List[int]] = None, upsample: int = 2) -> None:
+    """
+    Preprocess and render the (pkl_path, intermediate_path, passes) `files`.
+    Files are preprocessed by a pool of `preprocess_jobs` processes. The passes of a file are
+    queued for Blender as soon as it is preprocessed, sharing `max_jobs` Blender processes with
+    the other files. Passes whose videos are newer than the preprocessed data and were
+    rendered with the same `option_cmd` are skipped.
+    """
+    pool = JobPool(max_jobs)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, preprocess_jobs), mp_context=context) as executor:
+        futures = {
+            executor.submit(preprocess_pkl_file, str(pkl_path), str(intermediate_path), **preprocess_kwargs): (intermediate_path, passes)
+            for pkl_path, intermediate_path, passes in files
+        }
+        try:
+            while True:
+                busy = pool.poll()
+                for future in [future for future in futures if future.done()]:
+                    intermediate_path, passes = futures.pop(future)
+                    future.result()
+                    num_frames = int(load_intermediate(str(intermediate_path))["num_frames"])
+                    anim_frames = get_anim_frames(num_frames, upsample)
+                    frame_ranges = None
+                    if frame_chunk > 0 and not frame_no:
+                        frame_ranges = get_frame_ranges(anim_frames, frame_chunk)
+                    # render.py clamps the still frame to the sequence
+                    still_no = max(1, min(num_frames, frame_no)) if frame_no else None
+                    
+                    manifest = manifest_path(intermediate_path)
+                    stale = [
+                        (mode, video_path) for mode, video_path in passes
+                        if force_render
+                        or not is_up_to_date(get_video_files(video_path, cameras, anim_frames, still_no), manifest)
+                        or read_render_options(video_path) != option_cmd
+                    ]
+                    for mode, video_path in passes:
+                        if (mode, video_path) not in stale:
+                            print(f"Skipping {video_path}, videos are up to date")
+                    if not stale:
+                        continue
+                    stages = plan_passes(RENDER_SCRIPT_PATH, str(intermediate_path), stale, option_cmd, cameras, max_jobs, cameras_per_job, frame_ranges, server_ports)
+                    prepare_passes(stale, cameras, frame_ranges)
+                    pool.submit(stages, partial(finish_passes, stale, option_cmd))
+                    busy = True
+                if not futures and not busy:
+                    break
+                time.sleep(0.1)
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            pool.terminate()
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Build and render SMPL meshes")
-    parser.add_argument("-i", "--input", type=str, required=True, help=".pkl file or path to data directory")
+    parser.add_argument("-i", "--input", type=str, required=True, help=".pkl file or path to data directory, every .pkl file under a directory is rendered")
     parser.add_argument('-c', '--camera', type=int, help='Camera number, -1 for all cameras', default=0)
     parser.add_argument('-sc', '--scene', type=int, help='Scene number, default=0 for no furnitures', default=0)
     parser.add_argument('-q', '--high', action='store_true', help='Use high quality rendering settings')
@@ -27,6 +314,21 @@ def main() -> None:
     parser.add_argument('-ff', '--figure_floor', action='store_true', help='Render figure scene with transparent background and floor, only available for single frame image render')
     parser.add_argument('-cb', '--checkerboard', action='store_true', help='Render checkerboard pattern on the floor')
     parser.add_argument('-z', '--zoom', type=str, choices=[None, '0', '1', '2', '1l', '1r', '2l', '2r'], default=None)
+    parser.add_argument('-fp', '--force_preprocess', action='store_true', help='Rebuild the preprocessing cache even if it is up to date')
+    parser.add_argument('-d', '--device', type=str, choices=DEVICE_CHOICES, default='auto', help='Preprocessing device, auto uses CUDA when available')
+    parser.add_argument('-t', '--threads', type=int, default=None, help='CPU threads for preprocessing, default all cores')
+    parser.add_argument('-cs', '--chunk_size', type=int, default=PREPROCESS_CHUNK_SIZE, help='Frames per SMPL-X evaluation chunk, 0 evaluates all frames at once')
+    parser.add_argument('-sf', '--store_format', type=str, choices=INTERMEDIATE_FORMATS, default=INTERMEDIATE_FORMAT, help='Intermediate data format, npy is memory-mappable')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Blender processes rendering the output and input passes and camera groups in parallel, 1 renders both passes in one Blender process')
+    parser.add_argument('-cj', '--cameras_per_job', type=int, default=1, help='Cameras rendered by each parallel Blender worker')
+    parser.add_argument('-pj', '--preprocess_jobs', type=int, default=1, help='Preprocessing processes for a data directory')
+    parser.add_argument('-fr', '--force_render', action='store_true', help='Render every file of a data directory even if its videos are up to date')
+    parser.add_argument('-rs', '--render_servers', type=int, default=0, help='Start this many persistent Blender render servers and send all render jobs to them, replaces -j')
+    parser.add_argument('-fc', '--frame_chunk', type=int, default=0, help='Animation frames per render shard, shards render to PNG frames encoded into one video with ffmpeg, 0 renders the whole animation per worker')
+    parser.add_argument('-pm', '--prim_mode', type=str, choices=['objects', 'instances'], default='objects', help='objects: one object per joint and bone, instances: one Geometry Nodes instancing object for all actors')
+    parser.add_argument('-mm', '--mesh_mode', type=str, choices=['frames', 'handler', 'cache'], default='handler', help='frames: one object per animation frame, handler: one mesh per actor updated on frame change, cache: one mesh per actor reading PC2 point caches')
+    parser.add_argument('-pr', '--profile', action='store_true', help='Write a JSON report of phase times, peak memory, frame render times and scene counts next to each video')
+    parser.add_argument('-u', '--upsample', type=int, choices=[1, 2, 4], default=2, help='Animation frames per input frame, in-between frames are interpolated at playback time')
     
     args = parser.parse_args()
     input_path = args.input
@@ -40,33 +342,60 @@ def main() -> None:
     clothed = args.clothed
     figure_floor = args.figure_floor
     checkerboard = args.checkerboard
+    force_preprocess = args.force_preprocess
+    store_format = args.store_format
+    device = args.device
+    num_threads = args.threads
+    chunk_size = args.chunk_size or None
+    mesh_mode = args.mesh_mode
+    prim_mode = args.prim_mode
+    upsample = args.upsample
+    profile = args.profile
+    jobs = args.jobs
+    cameras_per_job = max(1, args.cameras_per_job)
+    frame_chunk = args.frame_chunk
+    preprocess_jobs = max(1, args.preprocess_jobs)
+    force_render = args.force_render
+    render_servers = args.render_servers
     # Create necessary directories
     input_path = Path(input_path)
-    if not input_path.is_file() or not input_path.suffix == '.pkl':
-        raise ValueError(f"{input_path} is not a .pkl file")
+    if input_path.is_dir():
+        pkl_paths = find_pkl_files(input_path)
+    elif input_path.is_file() and input_path.suffix == '.pkl':
+        pkl_paths = [input_path]
+    else:
+        raise ValueError(f"{input_path} is not a .pkl file or a directory")
         
     cache_dir = Path(CACHE_DIR)
     output_dir = Path(OUTPUT_DIR)
-    data_subdir = Path(f"{input_path.stem}")
     cache_dir.mkdir(exist_ok=True)
     output_dir.mkdir(exist_ok=True)
 
-    input_path = Path(input_path)
     quality = "cycles" if high else "eevee"
     
     file_name = f"{quality}_sc{scene_no}"
         
     file_name_output = file_name + "_output"
     file_name_input = file_name + "_input"
-    video_path_output = output_dir / data_subdir / file_name_output
-    video_path_input = output_dir / data_subdir / file_name_input
+    files = []
+    for pkl_path in pkl_paths:
+        data_subdir = Path(f"{pkl_path.stem}")
+        video_path_output = output_dir / data_subdir / file_name_output
+        video_path_input = output_dir / data_subdir / file_name_input
+        intermediate_path = get_intermediate_path(cache_dir, pkl_path.stem, store_format)
+        files.append((pkl_path, intermediate_path, [("output", video_path_output), ("input", video_path_input)]))
     
-    intermediate_path = cache_dir / f"{input_path.stem}.npz"
-    preprocess_pkl_file(str(input_path), str(intermediate_path))
+    if input_path.is_dir() and preprocess_jobs > 1 and num_threads is None:
+        # Share the cores between the preprocessing processes
+        num_threads = max(1, (os.cpu_count() or 1) // preprocess_jobs)
+    preprocess_kwargs = dict(force=force_preprocess, device=device, num_threads=num_threads, chunk_size=chunk_size, pc2=mesh_mode == "cache")
     
     option_cmd = [
         "-c", str(camera_no),
         "-sc", str(scene_no),
+        "-mm", mesh_mode,
+        "-pm", prim_mode,
+        "-u", str(upsample),
     ]
     if zoom:
         option_cmd.extend(["-z", str(zoom)])
@@ -84,9 +413,32 @@ def main() -> None:
         option_cmd.append("-cl")
     if checkerboard:
         option_cmd.append("-cb")
+    if profile:
+        option_cmd.append("-pr")
     
-    render_sequence(RENDER_SCRIPT_PATH, str(intermediate_path), video_path_output, option_cmd + ["-m", "output"])
-    render_sequence(RENDER_SCRIPT_PATH, str(intermediate_path), video_path_input, option_cmd + ["-m", "input"])
+    cameras = list(range(NUM_CAMERAS)) if camera_no == -1 else [camera_no]
+    server_ports, servers = None, []
+    if render_servers > 0:
+        server_ports, servers = start_render_servers(render_servers)
+        jobs = render_servers
+    rendered = False
+    try:
+        if input_path.is_dir():
+            print(f"Rendering {len(files)} files from {input_path}")
+            render_batch(files, preprocess_kwargs, option_cmd, cameras, frame_no, frame_chunk, jobs, cameras_per_job, preprocess_jobs, force_render, server_ports, upsample)
+        else:
+            _, intermediate_path, passes = files[0]
+            preprocess_pkl_file(str(input_path), str(intermediate_path), **preprocess_kwargs)
+            frame_ranges = None
+            if frame_chunk > 0 and not frame_no:
+                # Animation frames as set by render.py, input frames are followed by in-between frames
+                num_frames = int(load_intermediate(str(intermediate_path))["num_frames"])
+                frame_ranges = get_frame_ranges(get_anim_frames(num_frames, upsample), frame_chunk)
+            render_passes(RENDER_SCRIPT_PATH, str(intermediate_path), passes, option_cmd, cameras, jobs, cameras_per_job, frame_ranges, server_ports)
+        rendered = True
+    finally:
+        # Servers of a failed run may be busy with a job, a shutdown request would wait for it
+        stop_render_servers(server_ports or [], servers, graceful=rendered)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
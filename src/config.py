@@ -1,5 +1,12 @@
 BLENDER_PATH = "blender/scene.blend"
 OUTPUT_DIR = "output"
 CACHE_DIR = "cache"
+PREPROCESS_CHUNK_SIZE = 1024  # frames per SMPL-X evaluation chunk
+INTERMEDIATE_FORMAT = "npy"  # "npy": memory-mappable directory, "npz": compressed archive
 
-RENDER_SCRIPT_PATH = "src/render/render.py"
\ No newline at end of file
+RENDER_SCRIPT_PATH = "src/render/render.py"
+RENDER_SERVER_SCRIPT_PATH = "src/render/server.py"
+RENDER_CLIENT_SCRIPT_PATH = "src/render/client.py"
+ENCODE_SCRIPT_PATH = "src/render/encode.py"
+NUM_CAMERAS = 6  # viewpoints of get_camera_params, rendered with -c -1
+FRAME_RATE = 30  # fps of setup_animation_settings, used to encode sharded renders
\ No newline at end of file
@@ -0,0 +1,98 @@
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+def forward_output(process: subprocess.Popen, name: str, lock: threading.Lock, on_line: Optional[Callable[[str], None]] = None) -> None:
+    """Print the output of a job line by line with a [name] prefix, passing each line to `on_line`"""
+    # universal newlines also split the \r progress updates of Blender
+    for line in iter(process.stdout.readline, ""):
+        line = line.rstrip()
+        if line and on_line is not None:
+            on_line(line)
+        if line:
+            with lock:
+                print(f"[{name}] {line}", flush=True)
+
+class JobPool:
+    """
+    Subprocesses run at most `max_jobs` at a time, with their output merged into stdout.
+
+    Jobs are submitted as chains of stages, lists of (name, command): the jobs of a stage
+    start once every job of the previous stage succeeded, then `on_done` is called.
+    Chains of different submissions run side by side. When a job fails, `poll`
+    raises CalledProcessError and no further jobs are started.
+    """
+    def __init__(self, max_jobs: int = 1):
+        self.max_jobs = max(1, max_jobs)
+        self.pending = []
+        self.running = []
+        self.lock = threading.Lock()
+
+    def submit(self, stages: Sequence[Sequence[Tuple[str, List[str]]]], on_done: Optional[Callable[[], None]] = None) -> None:
+        chain = {"stages": [list(stage) for stage in stages], "remaining": 0, "on_done": on_done}
+        self.next_stage(chain)
+
+    def next_stage(self, chain: dict) -> None:
+        while chain["stages"]:
+            stage = chain["stages"].pop(0)
+            if stage:
+                chain["remaining"] = len(stage)
+                self.pending.extend((name, command, chain) for name, command in stage)
+                return
+        if chain["on_done"] is not None:
+            chain["on_done"]()
+
+    def poll(self) -> bool:
+        """Collect finished jobs and start pending ones, returns whether jobs are left"""
+        for job in list(self.running):
+            name, command, process, thread, chain = job
+            if process.poll() is None:
+                continue
+            thread.join()
+            self.running.remove(job)
+            if process.returncode != 0:
+                print(f"[{name}] failed with exit code {process.returncode}", file=sys.stderr, flush=True)
+                self.pending.clear()
+                raise subprocess.CalledProcessError(process.returncode, command)
+            chain["remaining"] -= 1
+            if chain["remaining"] == 0:
+                self.next_stage(chain)
+
+        while self.pending and len(self.running) < self.max_jobs:
+            name, command, chain = self.pending.pop(0)
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            thread = threading.Thread(target=forward_output, args=(process, name, self.lock), daemon=True)
+            thread.start()
+            self.running.append((name, command, process, thread, chain))
+        return bool(self.pending or self.running)
+
+    def wait(self) -> None:
+        while self.poll():
+            time.sleep(0.1)
+
+    def terminate(self) -> None:
+        """Stop the running jobs and drop the pending ones"""
+        self.pending.clear()
+        for _, _, process, _, _ in self.running:
+            if process.poll() is None:
+                process.terminate()
+        for _, _, process, thread, _ in self.running:
+            process.wait()
+            thread.join()
+        self.running.clear()
+
+def run_jobs(commands: Sequence[List[str]], max_jobs: int = 1, names: Optional[Sequence[str]] = None) -> None:
+    """
+    Run `commands` as subprocesses, at most `max_jobs` at a time.
+    Output of all jobs is merged into stdout. When a job fails, the running jobs
+    are terminated, pending ones are not started and CalledProcessError is raised.
+    """
+    names = names or [str(i) for i in range(len(commands))]
+    pool = JobPool(max_jobs)
+    pool.submit([list(zip(names, commands))])
+    try:
+        pool.wait()
+    finally:
+        pool.terminate()
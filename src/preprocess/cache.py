@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+# Bump when the layout or the meaning of the intermediate data changes
+PREPROCESS_VERSION = 1
+
+def file_digest(path, chunk_size=1 << 20):
+    """sha256 of a file's content, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def code_digest():
+    """sha256 over the sources of the preprocess package"""
+    digest = hashlib.sha256()
+    package_dir = Path(__file__).resolve().parent
+    for source in sorted(package_dir.glob("*.py")):
+        digest.update(source.name.encode())
+        digest.update(source.read_bytes())
+    return digest.hexdigest()
+
+def manifest_path(save_path):
+    """Manifest is stored next to the intermediate file, e.g. cache/seq.npz.json"""
+    save_path = Path(save_path)
+    return save_path.with_name(save_path.name + ".json")
+
+def compute_cache_key(pkl_path, model_files, gender, betas):
+    """
+    Hash everything the preprocessed output depends on.
+
+    Returns
+    -------
+    key: str
+        sha256 over the canonical JSON of `inputs`
+    inputs: dict
+        per-input fingerprints, written to the manifest for inspection
+    """
+    inputs = {
+        "version": PREPROCESS_VERSION,
+        "code": code_digest(),
+        "pkl": file_digest(pkl_path),
+        "models": {
+            os.path.basename(path): file_digest(path) if os.path.exists(path) else None
+            for path in model_files
+        },
+        "gender": gender,
+        "betas": [float(b) for b in betas],
+    }
+    key = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+    return key, inputs
+
+def load_manifest(save_path):
+    path = manifest_path(save_path)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_cache_valid(save_path, key, required=()):
+    """
+    Cached output and the files it depends on exist, and were built from the same inputs.
+    `required` dependencies must have been written with the cached output.
+    """
+    manifest = load_manifest(save_path)
+    if manifest is None or manifest.get("key") != key:
+        return False
+    if not set(str(path) for path in required) <= set(manifest.get("dependencies", [])):
+        return False
+    dependencies = [Path(save_path)]
+    dependencies += [Path(save_path).parent / path for path in manifest.get("dependencies", [])]
+    return all(path.exists() for path in dependencies)
+
+def invalidate_cache(save_path):
+    """Drop the manifest first so an interrupted rebuild is never reused"""
+    path = manifest_path(save_path)
+    if path.exists():
+        path.unlink()
+
+def write_manifest(save_path, key, inputs, pkl_path, dependencies=()):
+    """
+    dependencies: paths of other outputs the cached data refers to,
+        relative to the directory of `save_path`
+    """
+    manifest = {
+        "key": key,
+        "source": os.path.abspath(pkl_path),
+        "output": os.path.basename(save_path),
+        "dependencies": [str(path) for path in dependencies],
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "inputs": inputs,
+    }
+    path = manifest_path(save_path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
@@ -1,128 +1,113 @@
 import numpy as np
-from collections import defaultdict
 
 def close_surface(faces):
     """
-    Close a mesh with a single hole by:
-    1. Finding edges that form the hole (edges appearing only once)
-    2. Creating triangle strips (zig-zag pattern) to close the hole
-    3. Returning refined vertices and faces
-    
+    Close the holes of a mesh by:
+    1. Finding edges that form the holes (edges appearing only once)
+    2. Ordering each hole's boundary vertices into a cycle
+    3. Creating triangle strips (zig-zag pattern) to close each hole
+
     Args:
-        verts: (T, V, 3) array where T is number of frames, V is number of vertices
-        faces: (F, 3) array of face indices (constant across frames)
-    
+        faces: (F, K) array of face indices (constant across frames)
+
     Returns:
-        verts: (T, V, 3) array (unchanged, no new vertices added)
-        new_faces: (F', 3) array where F' = F + number of closing faces
+        new_faces: (F', 3) array where F' = F + number of closing faces,
+            the original faces if there is no hole
     """
-    
-    # Step 1: Find edges that form the hole (edges appearing only once)
-    edge_count = defaultdict(int)
-    
-    # Count edge occurrences (edges are undirected, so normalize order)
-    for face in faces:
-        num_verts = len(face)
-        for i in range(num_verts):
-            v1 = face[i]
-            v2 = face[(i + 1) % num_verts]
-            # Normalize edge order (smaller index first)
-            edge = tuple(sorted([v1, v2]))
-            edge_count[edge] += 1
-    
-    # Find hole edges (edges that appear only once)
-    hole_edges = [edge for edge, count in edge_count.items() if count == 1]
-    
+    faces = np.asarray(faces)
+    if len(faces) == 0:
+        return faces
+
+    # Step 1: Find edges that form the holes (edges appearing only once)
+    # Edges are undirected, so normalize order (smaller index first)
+    edges = np.stack([faces, np.roll(faces, -1, axis=1)], axis=-1).reshape(-1, 2)
+    edges = np.sort(edges, axis=1).astype(np.int64)
+    # Count edges through a single integer key per edge
+    edge_keys = edges[:, 0] * (int(edges.max()) + 1) + edges[:, 1]
+    _, first_index, counts = np.unique(edge_keys, return_index=True, return_counts=True)
+
+    # Keep hole edges in order of first appearance, which fixes where each boundary walk starts
+    hole_edges = edges[np.sort(first_index[counts == 1])]
+
     if len(hole_edges) == 0:
         # No hole found, return original mesh
         return faces
-    
-    # Step 2: Find all vertices on the hole boundary
-    hole_vertices = set()
-    for edge in hole_edges:
-        hole_vertices.add(edge[0])
-        hole_vertices.add(edge[1])
-    
-    hole_vertices = list(hole_vertices)
-    
-    # Create a mapping from hole vertices to their order around the hole
-    # We need to order the vertices to form a cycle
-    hole_vertex_order = _order_hole_vertices(hole_edges, hole_vertices)
-    
-    n = len(hole_vertex_order)
-    if n < 3:
-        # Not enough vertices to form a triangle
+
+    # Step 2: Order the vertices of each hole to form a cycle
+    holes = _order_hole_vertices(hole_edges)
+
+    # Step 3: Generate triangle strips (zig-zag pattern) to close the holes
+    new_faces = [faces]
+    for hole in holes:
+        n = len(hole)
+        if n < 3:
+            # Not enough vertices to form a triangle
+            continue
+        new_faces.append(hole[_zigzag_strip(n)].astype(faces.dtype))
+
+    if len(new_faces) == 1:
         return faces
-    
-    # Step 3: Generate triangle strip (zig-zag pattern) to close the hole
-    new_faces = faces.tolist() if isinstance(faces, np.ndarray) else list(faces)
-    
-    # Triangle strip pattern: (0, 1, n-1), (n-1, 1, 2), (n-2, n-1, 2), (n-2, 2, 3), ...
-    # This creates a fan pattern that closes the hole
-    
-    v = hole_vertex_order  # Shorthand for ordered vertices
-    
-    # First triangle: (0, 1, n-1)
-    new_faces.append([v[0], v[1], v[n-1]])
-    
-    # Track indices: end_idx moves from n-1 down, start_idx moves from 1 up
-    end_idx = n - 1
-    start_idx = 1
-    step = 0
-    
-    # Generate triangles alternating between end and start
-    while start_idx < end_idx - 1:
-        if step % 2 == 0:
-            # Even step: (end-1, end, start) - move end_idx down
-            new_faces.append([v[end_idx - 1], v[end_idx], v[start_idx]])
-            end_idx -= 1
-        else:
-            # Odd step: (end, start, start+1) - move start_idx up
-            new_faces.append([v[end_idx], v[start_idx], v[start_idx + 1]])
-            start_idx += 1
-        step += 1
-    
-    new_faces = np.array(new_faces, dtype=faces.dtype)
-    
-    return new_faces
-
-
-def _order_hole_vertices(hole_edges, hole_vertices):
+    return np.concatenate(new_faces, axis=0)
+
+
+def _zigzag_strip(n):
     """
-    Order hole vertices to form a cycle by following connected edges.
-    Returns ordered list of vertex indices.
+    Triangle strip over a cycle of n vertices, as (n-2, 3) indices into the cycle.
+
+    Pattern: (0, 1, n-1), (n-2, n-1, 1), (n-2, 1, 2), (n-3, n-2, 2), ...
+    alternating between moving the end index down and the start index up.
     """
-    if len(hole_vertices) == 0:
-        return []
-    
-    # Build adjacency list for hole edges
-    adj = defaultdict(list)
-    for edge in hole_edges:
-        v1, v2 = edge
-        adj[v1].append(v2)
-        adj[v2].append(v1)
-    
-    # Start from first vertex and follow the cycle
-    ordered = []
-    visited_edges = set()
-    start_vertex = hole_vertices[0]
-    current_vertex = start_vertex
-    
-    # Follow the cycle
-    while len(ordered) < len(hole_vertices):
-        ordered.append(current_vertex)
-        # Find next unvisited edge from current vertex
-        next_vertex = None
-        for neighbor in adj[current_vertex]:
-            edge = tuple(sorted([current_vertex, neighbor]))
-            if edge not in visited_edges:
-                visited_edges.add(edge)
-                next_vertex = neighbor
-                break
-        
-        if next_vertex is None:
-            # Cycle complete or disconnected (shouldn't happen for single hole)
-            break
-        current_vertex = next_vertex
-    
-    return ordered
\ No newline at end of file
+    # step k has moved the end index down ceil(k/2) times and the start index up floor(k/2) times
+    k = np.arange(n - 3)
+    end = n - 1 - (k + 1) // 2
+    start = 1 + k // 2
+    even = (k % 2 == 0)[:, None]
+    strip = np.where(
+        even,
+        np.stack([end - 1, end, start], axis=1),
+        np.stack([end, start, start + 1], axis=1),
+    )
+    return np.concatenate([[[0, 1, n - 1]], strip.reshape(-1, 3)], axis=0).astype(np.int64)
+
+
+def _order_hole_vertices(hole_edges):
+    """
+    Order hole vertices to form cycles by following connected edges.
+    Returns a list of ordered vertex index arrays, one per hole.
+    """
+    # Adjacency array (CSR): neighbours of every boundary vertex in edge order,
+    # with the hole edge each neighbour is reached through
+    vertices, local = np.unique(hole_edges, return_inverse=True)
+    local = local.reshape(-1, 2)
+    src = local.reshape(-1)
+    dst = local[:, ::-1].reshape(-1)
+    order = np.argsort(src, kind="stable")
+    neighbours = dst[order].tolist()
+    neighbour_edges = (order // 2).tolist()
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=len(vertices)))]).tolist()
+
+    # Walks start in the iteration order of the set of boundary vertices,
+    # the first hole is walked from `list(set(...))[0]` as before
+    start_vertices = np.searchsorted(vertices, list(set(hole_edges.reshape(-1).tolist())))
+    visited_vertices = np.zeros(len(vertices), dtype=bool)
+    visited_edges = np.zeros(len(hole_edges), dtype=bool)
+    holes = []
+    for start_vertex in start_vertices.tolist():
+        if visited_vertices[start_vertex]:
+            continue
+        ordered = []
+        current_vertex = start_vertex
+        while current_vertex is not None and not visited_vertices[current_vertex]:
+            ordered.append(current_vertex)
+            visited_vertices[current_vertex] = True
+            # Find next unvisited edge from current vertex
+            next_vertex = None
+            for i in range(offsets[current_vertex], offsets[current_vertex + 1]):
+                if not visited_edges[neighbour_edges[i]]:
+                    visited_edges[neighbour_edges[i]] = True
+                    next_vertex = neighbours[i]
+                    break
+            current_vertex = next_vertex
+        holes.append(vertices[ordered])
+
+    return holes
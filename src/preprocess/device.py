@@ -0,0 +1,30 @@
+import os
+
+import torch
+
+DEVICE_CHOICES = ("auto", "cuda", "cpu")
+
+def resolve_device(device="auto"):
+    """
+    Pick the torch device for preprocessing.
+    "auto" uses CUDA when available, a CUDA request on a machine without it falls back to CPU.
+    """
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = torch.device(device)
+    if device.type == "cuda" and not torch.cuda.is_available():
+        print("Warning: CUDA is not available, falling back to CPU")
+        device = torch.device("cpu")
+    return device
+
+def configure_threads(device, num_threads=None):
+    """Use every core for CPU preprocessing unless a thread count is given"""
+    if device.type != "cpu":
+        return
+    num_threads = num_threads or os.cpu_count() or 1
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(min(num_threads, 4))
+    except RuntimeError:
+        # can only be set once, before any inter-op parallel work
+        pass
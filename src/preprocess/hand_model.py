@@ -4,14 +4,35 @@ Modified from https://github.com/PKU-EPIC/DexGraspNet
 
 import json
 import os
-import pickle
-import sys
 
 import numpy as np
 import plotly.graph_objects as go
-import smplx
 import torch
+import torch.nn.functional as F
 import trimesh as tm
+from smplx.lbs import batch_rodrigues, transform_mat
+
+from .model_registry import get_smplx_model, get_mano_tables, get_hand_rig
+
+DEFAULT_BETA = [
+    0.8882,
+    0.0634,
+    0.7364,
+    -2.1568,
+    -1.0418,
+    -0.5665,
+    4.1727,
+    1.4160,
+    2.1836,
+    2.5980,
+    -2.3136,
+    -0.6962,
+    1.7863,
+    0.0176,
+    0.7098,
+    1.5602,
+]
+
 
 class HandModel:
     def __init__(
@@ -19,29 +40,14 @@ class HandModel:
         mano_root="",
         contact_indices_path="",
         pose_distrib_path="",
-        beta=[
-            0.8882,
-            0.0634,
-            0.7364,
-            -2.1568,
-            -1.0418,
-            -0.5665,
-            4.1727,
-            1.4160,
-            2.1836,
-            2.5980,
-            -2.3136,
-            -0.6962,
-            1.7863,
-            0.0176,
-            0.7098,
-            1.5602,
-        ],
+        beta=None,
         gender="male",
         device="cpu",
         left_hand=False,
         batch_size=1,
         no_fc=False,
+        dtype=torch.float32,
+        hand_only=True,
     ):
         """
         Create a Hand Model for MANO
@@ -56,50 +62,29 @@ class HandModel:
             path to a multivariate gaussian distribution of the `thetas` of MANO
         device: str | torch.Device
             device for torch tensors
+        dtype: torch.dtype
+            floating point type of the SMPL-X model
+        hand_only: bool
+            evaluate only the wrist and finger chain on the hand vertices
+            instead of the full SMPL-X body, results match to float tolerance
         """
         self.left_hand = left_hand  # NOTE: only support all batch left or right
-        # load SMPL-X
-        smplx_model_path = os.path.join(
-            os.path.dirname(os.path.abspath(os.path.realpath(sys.argv[0]))),
-            "data",
-            "smpl_all_models",
-        )
+        # SMPL-X and the MANO index tables are shared by all hand models of the
+        # same gender/device/dtype, this instance only selects its hand.
+        # `batch_size` is kept for compatibility, the shared model takes any batch size.
+        if beta is None:
+            beta = DEFAULT_BETA
         self.beta = torch.tensor([beta]).to(device=device)
-        self.sbj_m = smplx.create(
-            model_path=smplx_model_path,
-            model_type="smplx",
-            gender=gender,
-            batch_size=batch_size,
-            flat_hand_mean=True,
-            use_pca=False,
-        ).to(device=device)
-        data = pickle.load(
-            open(
-                os.path.join(
-                    os.path.dirname(os.path.abspath(os.path.realpath(sys.argv[0]))),
-                    "data",
-                    "smpl_all_models",
-                    "MANO_SMPLX_vertex_ids.pkl",
-                ),
-                "rb",
-            ),
-        )
-        self.lhand_verts = torch.from_numpy(data["left_hand"]).to(device=device)
-        self.rhand_verts = torch.from_numpy(data["right_hand"]).to(device=device)
-        data = pickle.load(
-            open(
-                os.path.join(
-                    os.path.dirname(os.path.abspath(os.path.realpath(sys.argv[0]))),
-                    "data",
-                    "smpl_all_models",
-                    "MANO_SMPLX_face_ids.pkl",
-                ),
-                "rb",
-            ),
-        )
-        self.lhand_faces = torch.from_numpy(data["left_hand"]).to(device=device)
-        self.rhand_faces = torch.from_numpy(data["right_hand"]).to(device=device)
+        self.sbj_m = get_smplx_model(gender, device, dtype)
+        mano_tables = get_mano_tables(device)
+        self.lhand_verts = mano_tables["left_hand_verts"]
+        self.rhand_verts = mano_tables["right_hand_verts"]
+        self.lhand_faces = mano_tables["left_hand_faces"]
+        self.rhand_faces = mano_tables["right_hand_faces"]
+        self.hand_verts = self.lhand_verts if self.left_hand else self.rhand_verts
         self.hand_faces = self.lhand_faces if self.left_hand else self.rhand_faces
+        self.hand_only = hand_only
+        self.rig = get_hand_rig(gender, device, dtype, left_hand) if hand_only else None
 
         self.device = device
 
@@ -246,24 +231,25 @@ class HandModel:
         hand_pose_mirrored.requires_grad_()
         return hand_pose_mirrored
     
-    def set_parameters(self, hand_pose, contact_point_indices=None, distance_point_indices=None, skip_left_mirror=False):
+    def _neutral_smplx_inputs(self, batch):
         """
-        Set translation, rotation, thetas, and contact points of grasps
+        Zero shape, expression, jaw and eye inputs for a batch.
 
-        Parameters
-        ----------
-        hand_pose: (B, 3+3+45) torch.FloatTensor
-            translation, rotation in axis angles, and `thetas`
-        contact_point_indices: (B, `n_contact`) [Optional]torch.LongTensor
-            indices of contact candidates
+        The shared SMPL-X model is built with batch_size=1, so these are passed
+        explicitly. They equal the model defaults the forward pass used before:
+        SMPL-X never consumed `self.beta`, hands are evaluated in the neutral shape.
         """
-        if self.left_hand and not skip_left_mirror: # skip left mirror: parameter is already mirrored
-            hand_pose = self.mirror_pose(hand_pose)
-
-        self.hand_pose = hand_pose
-        if self.hand_pose.requires_grad:
-            self.hand_pose.retain_grad()
+        zeros = lambda dim: torch.zeros((batch, dim), dtype=torch.float32, device=self.device)
+        return dict(
+            betas=zeros(self.sbj_m.num_betas),
+            expression=zeros(self.sbj_m.num_expression_coeffs),
+            jaw_pose=zeros(3),
+            leye_pose=zeros(3),
+            reye_pose=zeros(3),
+        )
 
+    def _forward_smplx(self, hand_pose):
+        """Hand keypoints and vertices from a full SMPL-X body evaluation"""
         batch = hand_pose.shape[0]
         global_orient = torch.zeros((batch, 3), dtype=torch.float32, device=self.device)
         zero_hand = torch.zeros((batch, 45), dtype=torch.float32, device=self.device)
@@ -283,9 +269,9 @@ class HandModel:
                 left_hand_pose=hand_pose[:, -45:],
                 right_hand_pose=zero_hand,
                 transl=root_trans,
-                beta=self.beta.repeat(batch, 1),
+                **self._neutral_smplx_inputs(batch),
             )
-            self.keypoints = torch.cat(
+            keypoints = torch.cat(
                 (
                     output.joints[:, 20:21],
                     output.joints[:, 25:40],
@@ -293,7 +279,7 @@ class HandModel:
                 ),
                 dim=1,
             )
-            self.vertices = output.vertices[:, self.lhand_verts]
+            vertices = output.vertices[:, self.lhand_verts]
         else:
             body_pose = torch.cat(
                 (
@@ -308,9 +294,9 @@ class HandModel:
                 left_hand_pose=zero_hand,
                 right_hand_pose=hand_pose[:, -45:],
                 transl=root_trans,
-                beta=self.beta.repeat(batch, 1),
+                **self._neutral_smplx_inputs(batch),
             )
-            self.keypoints = torch.cat(
+            keypoints = torch.cat(
                 (
                     output.joints[:, 21:22],
                     output.joints[:, 40:55],
@@ -318,7 +304,71 @@ class HandModel:
                 ),
                 dim=1,
             )
-            self.vertices = output.vertices[:, self.rhand_verts]
+            vertices = output.vertices[:, self.rhand_verts]
+        return keypoints, vertices
+
+    def _forward_hand(self, hand_pose):
+        """
+        Hand keypoints and vertices from the wrist and finger chain only
+
+        Linear blend skinning restricted to the MANO vertices, see `HandRig`.
+        Keypoints are the wrist, the 15 finger joints and the 5 fingertips.
+        """
+        rig = self.rig
+        batch = hand_pose.shape[0]
+        dtype = rig.v_template.dtype
+        pose = torch.cat((hand_pose[:, 3:6], hand_pose[:, -45:]), dim=-1).to(dtype)
+        num_joints = len(rig.parents)
+
+        rot_mats = batch_rodrigues(pose.reshape(-1, 3)).view(batch, num_joints, 3, 3)
+        ident = torch.eye(3, dtype=dtype, device=pose.device)
+        pose_feature = (rot_mats - ident).view(batch, -1)
+        v_posed = rig.v_template + torch.matmul(pose_feature, rig.posedirs).view(batch, -1, 3)
+
+        # ancestors of the wrist are unrotated, so the wrist transform starts from its rest location
+        transforms_mat = transform_mat(
+            rot_mats.reshape(-1, 3, 3),
+            rig.rel_joints.expand(batch, -1, -1).reshape(-1, 3, 1),
+        ).view(batch, num_joints, 4, 4)
+        transform_chain = [transforms_mat[:, 0]]
+        for i in range(1, num_joints):
+            transform_chain.append(torch.matmul(transform_chain[rig.parents[i]], transforms_mat[:, i]))
+        transforms = torch.stack(transform_chain, dim=1)
+        posed_joints = transforms[:, :, :3, 3]
+
+        joints_homogen = F.pad(rig.joints.unsqueeze(-1), [0, 0, 0, 1])
+        rel_transforms = transforms - F.pad(torch.matmul(transforms, joints_homogen), [3, 0, 0, 0, 0, 0, 0, 0])
+
+        ident4 = torch.eye(4, dtype=dtype, device=pose.device).view(1, 16)
+        T = (torch.matmul(rig.lbs_weights, rel_transforms.view(batch, num_joints, 16))
+             + rig.rest_weights * ident4).view(batch, -1, 4, 4)
+        verts = torch.matmul(T[:, :, :3, :3], v_posed.unsqueeze(-1))[..., 0] + T[:, :, :3, 3]
+
+        keypoints = torch.cat((posed_joints, verts[:, rig.num_verts:]), dim=1)
+        return keypoints, verts[:, :rig.num_verts]
+
+    def set_parameters(self, hand_pose, contact_point_indices=None, distance_point_indices=None, skip_left_mirror=False):
+        """
+        Set translation, rotation, thetas, and contact points of grasps
+
+        Parameters
+        ----------
+        hand_pose: (B, 3+3+45) torch.FloatTensor
+            translation, rotation in axis angles, and `thetas`
+        contact_point_indices: (B, `n_contact`) [Optional]torch.LongTensor
+            indices of contact candidates
+        """
+        if self.left_hand and not skip_left_mirror: # skip left mirror: parameter is already mirrored
+            hand_pose = self.mirror_pose(hand_pose)
+
+        self.hand_pose = hand_pose
+        if self.hand_pose.requires_grad:
+            self.hand_pose.retain_grad()
+
+        if self.hand_only:
+            self.keypoints, self.vertices = self._forward_hand(hand_pose)
+        else:
+            self.keypoints, self.vertices = self._forward_smplx(hand_pose)
 
         wrist_pos = self.keypoints[:, 0].detach().clone()
         true_wrist_pos = hand_pose[:, :3]
@@ -0,0 +1,155 @@
+"""
+Process-level cache of the SMPL-X body model and the MANO index tables.
+
+Left and right HandModel instances only differ in which vertex subset and
+pose slot they use, so they share one SMPL-X model per (gender, device, dtype)
+instead of each loading it from disk.
+"""
+
+import os
+import pickle
+import sys
+
+import smplx
+import torch
+
+_smplx_models = {}
+_mano_tables = {}
+_hand_rigs = {}
+
+# SMPL-X joint indices of the hand chains: wrist followed by the 15 finger joints
+LEFT_HAND_JOINTS = [20] + list(range(25, 40))
+RIGHT_HAND_JOINTS = [21] + list(range(40, 55))
+
+
+def get_smplx_model_dir():
+    """Directory holding the SMPL-X models and the MANO index tables"""
+    return os.path.join(
+        os.path.dirname(os.path.abspath(os.path.realpath(sys.argv[0]))),
+        "data",
+        "smpl_all_models",
+    )
+
+
+def get_smplx_model_files(gender):
+    """Files read from disk when building a HandModel of the given gender"""
+    model_dir = get_smplx_model_dir()
+    return [
+        os.path.join(model_dir, "smplx", f"SMPLX_{gender.upper()}.npz"),
+        os.path.join(model_dir, "MANO_SMPLX_vertex_ids.pkl"),
+        os.path.join(model_dir, "MANO_SMPLX_face_ids.pkl"),
+    ]
+
+
+def get_smplx_model(gender, device, dtype=torch.float32):
+    """
+    Shared SMPL-X model, built with batch_size=1.
+
+    Callers must pass every per-sample input (betas, expression, jaw/eye poses)
+    explicitly so the model can evaluate any batch size.
+    """
+    device = torch.device(device)
+    key = (gender, str(device), dtype)
+    if key not in _smplx_models:
+        _smplx_models[key] = smplx.create(
+            model_path=get_smplx_model_dir(),
+            model_type="smplx",
+            gender=gender,
+            batch_size=1,
+            flat_hand_mean=True,
+            use_pca=False,
+            dtype=dtype,
+        ).to(device=device)
+    return _smplx_models[key]
+
+
+def get_mano_tables(device):
+    """
+    MANO vertex and face index tables of SMPL-X, as torch tensors on `device`
+
+    Returns
+    -------
+    tables: dict
+        "left_hand_verts", "right_hand_verts", "left_hand_faces", "right_hand_faces"
+    """
+    device = torch.device(device)
+    key = str(device)
+    if key not in _mano_tables:
+        model_dir = get_smplx_model_dir()
+        with open(os.path.join(model_dir, "MANO_SMPLX_vertex_ids.pkl"), "rb") as f:
+            vertex_ids = pickle.load(f)
+        with open(os.path.join(model_dir, "MANO_SMPLX_face_ids.pkl"), "rb") as f:
+            face_ids = pickle.load(f)
+        _mano_tables[key] = {
+            "left_hand_verts": torch.from_numpy(vertex_ids["left_hand"]).to(device=device),
+            "right_hand_verts": torch.from_numpy(vertex_ids["right_hand"]).to(device=device),
+            "left_hand_faces": torch.from_numpy(face_ids["left_hand"]).to(device=device),
+            "right_hand_faces": torch.from_numpy(face_ids["right_hand"]).to(device=device),
+        }
+    return _mano_tables[key]
+
+
+class HandRig:
+    """
+    SMPL-X restricted to one hand, precomputed for the neutral shape.
+
+    With zero global orient, body pose (except the wrist), jaw, eyes and shape,
+    every joint outside the wrist and finger chain has an identity skinning
+    transform and no pose blend shape contribution. Skinning the hand vertices
+    with the 16 hand joints plus an identity term for the remaining weight is
+    therefore exact.
+
+    Attributes
+    ----------
+    v_template: (V', 3) rest vertices, the MANO vertices followed by the 5 fingertip vertices
+    posedirs: (16*9, V'*3) pose blend shapes of the hand joints
+    lbs_weights: (V', 16) skinning weights of the hand joints
+    rest_weights: (V', 1) remaining weight, skinned with identity
+    joints: (16, 3) rest joint locations
+    rel_joints: (16, 3) joint offsets to the parent, world location for the wrist
+    parents: list of parent indices into the 16 joints, -1 for the wrist
+    num_verts: number of MANO vertices in `v_template`
+    """
+    def __init__(self, sbj_m, hand_verts, left_hand):
+        hand_joints = LEFT_HAND_JOINTS if left_hand else RIGHT_HAND_JOINTS
+        # fingertip vertices of the vertex joint selector: 5 left then 5 right tips, last in the list
+        tip_verts = sbj_m.vertex_joint_selector.extra_joints_idxs[-10:-5] if left_hand \
+            else sbj_m.vertex_joint_selector.extra_joints_idxs[-5:]
+        verts = torch.cat((hand_verts.to(tip_verts.device).long(), tip_verts.long()))
+
+        v_template = sbj_m.v_template
+        joints = torch.einsum("vk,jv->jk", v_template, sbj_m.J_regressor)
+        joint_idx = torch.tensor(hand_joints, device=v_template.device)
+        num_joints = sbj_m.J_regressor.shape[0]
+
+        self.num_verts = len(hand_verts)
+        self.v_template = v_template[verts]
+        posedirs = sbj_m.posedirs.view(num_joints - 1, 9, -1, 3)
+        self.posedirs = posedirs[joint_idx - 1][:, :, verts].reshape(len(hand_joints) * 9, -1)
+        self.lbs_weights = sbj_m.lbs_weights[verts][:, joint_idx]
+        self.rest_weights = 1 - self.lbs_weights.sum(dim=1, keepdim=True)
+
+        parents = sbj_m.parents.tolist()
+        self.parents = [-1] + [hand_joints.index(parents[j]) for j in hand_joints[1:]]
+        self.joints = joints[joint_idx]
+        self.rel_joints = self.joints.clone()
+        self.rel_joints[1:] -= self.joints[self.parents[1:]]
+
+
+def get_hand_rig(gender, device, dtype=torch.float32, left_hand=False):
+    """Shared `HandRig` for one hand of the SMPL-X model"""
+    device = torch.device(device)
+    key = (gender, str(device), dtype, left_hand)
+    if key not in _hand_rigs:
+        tables = get_mano_tables(device)
+        hand_verts = tables["left_hand_verts"] if left_hand else tables["right_hand_verts"]
+        with torch.no_grad():
+            _hand_rigs[key] = HandRig(get_smplx_model(gender, device, dtype), hand_verts, left_hand)
+    return _hand_rigs[key]
+
+
+def clear_model_registry():
+    """Release all cached models, e.g. before switching devices"""
+    _smplx_models.clear()
+    _mano_tables.clear()
+    _hand_rigs.clear()
@@ -0,0 +1,67 @@
+"""
+PC2 point cache files.
+
+Standard point cache layout read by Blender's Mesh Cache modifier: a 32 byte
+header followed by float32 (samples, points, 3) vertex positions. Positions are
+stored in Blender coordinates (y and z swapped), so the modifier can use them as is.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+PC2_SIGNATURE = b"POINTCACHE2\0"
+PC2_HEADER = np.dtype([
+    ("signature", "S12"),
+    ("version", "<i4"),
+    ("num_points", "<i4"),
+    ("start_frame", "<f4"),
+    ("sample_rate", "<f4"),
+    ("num_samples", "<i4"),
+])
+
+def get_pc2_dir(save_path):
+    """PC2 files of an intermediate are stored next to it, e.g. cache/seq_pc2/"""
+    save_path = Path(save_path)
+    return save_path.with_name(f"{save_path.stem}_pc2")
+
+def get_pc2_path(save_path, name):
+    return get_pc2_dir(save_path) / f"{name}.pc2"
+
+def write_pc2(path, verts, num_samples=None, chunk_size=None):
+    """
+    Stream the first `num_samples` frames of `verts` (N, V, 3) into a PC2 file,
+    `chunk_size` frames at a time so memory-mapped inputs are never fully loaded
+    """
+    num_samples = num_samples or verts.shape[0]
+    chunk_size = chunk_size or num_samples
+    header = np.array(
+        [(PC2_SIGNATURE, 1, verts.shape[1], 0.0, 1.0, num_samples)], dtype=PC2_HEADER
+    )
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(header.tobytes())
+        for start in range(0, num_samples, chunk_size):
+            end = min(start + chunk_size, num_samples)
+            chunk = np.asarray(verts[start:end], dtype="<f4")
+            f.write(np.ascontiguousarray(chunk[..., [0, 2, 1]]).tobytes())
+    os.replace(tmp_path, path)
+
+def read_pc2_header(path):
+    header = np.fromfile(path, dtype=PC2_HEADER, count=1)[0]
+    if header["signature"] != PC2_SIGNATURE.rstrip(b"\0"):
+        raise ValueError(f"{path} is not a PC2 file")
+    return header
+
+def read_pc2_frame(path, index):
+    """Vertex positions (V, 3) of sample `index`, read without loading the whole file"""
+    header = read_pc2_header(path)
+    num_points = int(header["num_points"])
+    samples = np.memmap(
+        path, dtype="<f4", mode="r", offset=PC2_HEADER.itemsize,
+        shape=(int(header["num_samples"]), num_points, 3),
+    )
+    return np.array(samples[index])
@@ -1,21 +1,74 @@
 import pickle
 import torch
 import os
-import numpy as np
+from pathlib import Path
 
-from .hand_model import HandModel
-from .close_surface import close_surface
+from .hand_model import HandModel, DEFAULT_BETA
+from .model_registry import get_smplx_model_files
+from .topology import ensure_hand_topology, get_topology_path
 from .safe_load import safe_load_pkl
+from .device import resolve_device, configure_threads
+from .store import IntermediateWriter
+from .pc2 import get_pc2_path, write_pc2
+from .cache import compute_cache_key, is_cache_valid, invalidate_cache, write_manifest
 
-def preprocess_pkl_file(pkl_path, save_path):
-    # if os.path.exists(save_path):
-    #     print(f"Preprocessed data already exists at {save_path}")
-    #     return
+def evaluate_hand_vertices(hand_model, hand_params, out, device, chunk_size=None):
+    """
+    Run `hand_model` over `hand_params` (N, 3+3+45) in chunks of `chunk_size` frames
+    and write the hand vertices into the preallocated `out` (N, 778, 3)
+    """
+    num_frames = hand_params.shape[0]
+    chunk_size = chunk_size or num_frames
+    for start in range(0, num_frames, chunk_size):
+        end = min(start + chunk_size, num_frames)
+        # hand parameters may come as float64 or on another device
+        chunk = hand_params[start:end].to(device=device, dtype=torch.float32)
+        hand_model.set_parameters(chunk, skip_left_mirror=True)
+        out[start:end] = hand_model.vertices.cpu().numpy()
+
+def gather_hand_vertices(body_vertices, hand_verts_idx, out, chunk_size=None):
+    """Copy the hand subset of body vertices (N, V, 3) into `out` (N, 778, 3) chunk by chunk"""
+    num_frames = out.shape[0]
+    chunk_size = chunk_size or num_frames
+    hand_verts_idx = hand_verts_idx.to(body_vertices.device)
+    for start in range(0, num_frames, chunk_size):
+        end = min(start + chunk_size, num_frames)
+        out[start:end] = body_vertices[start:end][:, hand_verts_idx].detach().cpu().numpy()
+
+def preprocess_pkl_file(pkl_path, save_path, gender="female", force=False, device="auto", num_threads=None, chunk_size=None, pc2=False):
+    """
+    Evaluate the hand meshes of a sequence and write the intermediate data for rendering.
+
+    With `chunk_size`, SMPL-X is evaluated `chunk_size` frames at a time and results are
+    streamed into preallocated (memory-mapped for npy stores) arrays, so peak memory
+    stays bounded for long sequences.
+
+    With `pc2`, the object and hand vertex animations are also written as PC2 point
+    caches next to the intermediate data (see `get_pc2_path`) for Blender's Mesh Cache modifier.
+    """
+    cache_dir = Path(save_path).parent
+    pc2_names = ["obj_verts"] + [
+        f"{mode}_{person}_hand_{side}_verts"
+        for mode in ("output", "input") for person in ("p1", "p2") for side in ("left", "right")
+    ]
+    pc2_paths = [get_pc2_path(save_path, name) for name in pc2_names] if pc2 else []
+    pc2_dependencies = [path.relative_to(cache_dir) for path in pc2_paths]
+
+    cache_key, cache_inputs = compute_cache_key(
+        pkl_path, get_smplx_model_files(gender), gender, DEFAULT_BETA
+    )
+    if not force and is_cache_valid(save_path, cache_key, required=pc2_dependencies):
+        print(f"Preprocessed data is up to date at {save_path}")
+        return
+    invalidate_cache(save_path)
         
-    device = torch.device("cuda")
+    device = resolve_device(device)
+    configure_threads(device, num_threads)
+    print(f"Preprocessing {pkl_path} on {device}")
 
     with open(pkl_path, "rb") as f:
-        data = safe_load_pkl(pkl_path)
+        # tensors stay on the CPU, chunks are moved to `device` when evaluated
+        data = safe_load_pkl(pkl_path, torch.device("cpu"))
         
         obj_faces_list = data["obj_faces_list"]
         original_obj_verts_list = data["original_obj_verts_list"]
@@ -70,53 +123,61 @@ def preprocess_pkl_file(pkl_path, save_path):
     input_p2_body_vertices = input_p2_body_vertices[:num_frames]
     obj_verts = obj_verts[:num_frames]
 
-    hand_model_left = HandModel(left_hand=True, gender="female", device=device, batch_size=num_frames)
-    hand_model_right = HandModel(left_hand=False, gender="female", device=device, batch_size=num_frames)
+    hand_model_left = HandModel(left_hand=True, gender=gender, device=device, batch_size=num_frames)
+    hand_model_right = HandModel(left_hand=False, gender=gender, device=device, batch_size=num_frames)
 
-    with torch.no_grad():
-        hand_model_left.set_parameters(p1_hand_parmas_left, skip_left_mirror=True)
-        hand_model_right.set_parameters(p1_hand_parmas_right, skip_left_mirror=True)
-        
-        p1_hand_left_verts = hand_model_left.vertices.detach().cpu().numpy()
-        p1_hand_right_verts = hand_model_right.vertices.detach().cpu().numpy()
-        
-        hand_model_left.set_parameters(p2_hand_parmas_left, skip_left_mirror=True)
-        hand_model_right.set_parameters(p2_hand_parmas_right, skip_left_mirror=True)
-        
-        p2_hand_left_verts = hand_model_left.vertices.detach().cpu().numpy()
-        p2_hand_right_verts = hand_model_right.vertices.detach().cpu().numpy()
+    writer = IntermediateWriter(save_path)
+    vertex_arrays = {"obj_verts": obj_verts}
+    hand_outputs = [
+        (hand_model_left, p1_hand_parmas_left, "output_p1_hand_left_verts"),
+        (hand_model_right, p1_hand_parmas_right, "output_p1_hand_right_verts"),
+        (hand_model_left, p2_hand_parmas_left, "output_p2_hand_left_verts"),
+        (hand_model_right, p2_hand_parmas_right, "output_p2_hand_right_verts"),
+    ]
+    with torch.inference_mode():
+        for hand_model, hand_params, name in hand_outputs:
+            out = writer.allocate(name, (hand_params.shape[0], len(hand_model.hand_verts), 3))
+            evaluate_hand_vertices(hand_model, hand_params, out, device, chunk_size)
+            vertex_arrays[name] = out
         
     hand_verts_idx_left = hand_model_left.lhand_verts
     hand_verts_idx_right = hand_model_right.rhand_verts
-    input_p1_hand_left_verts = input_p1_body_vertices[:,hand_verts_idx_left].detach().cpu().numpy()
-    input_p2_hand_left_verts = input_p2_body_vertices[:,hand_verts_idx_left].detach().cpu().numpy()
-    input_p1_hand_right_verts = input_p1_body_vertices[:,hand_verts_idx_right].detach().cpu().numpy()
-    input_p2_hand_right_verts = input_p2_body_vertices[:,hand_verts_idx_right].detach().cpu().numpy()
-
-    hand_left_faces = hand_model_left.hand_faces.detach().cpu().numpy()
-    hand_right_faces = hand_model_right.hand_faces.detach().cpu().numpy()
-    hand_left_faces = close_surface(hand_left_faces)
-    hand_right_faces = close_surface(hand_right_faces)
-
-    # Save data in numpy 1.23 compatibility format:
-    np.savez_compressed(
-        save_path,
+    input_hands = [
+        (input_p1_body_vertices, hand_verts_idx_left, "input_p1_hand_left_verts"),
+        (input_p2_body_vertices, hand_verts_idx_left, "input_p2_hand_left_verts"),
+        (input_p1_body_vertices, hand_verts_idx_right, "input_p1_hand_right_verts"),
+        (input_p2_body_vertices, hand_verts_idx_right, "input_p2_hand_right_verts"),
+    ]
+    for body_vertices, hand_verts_idx, name in input_hands:
+        out = writer.allocate(
+            name,
+            (body_vertices.shape[0], len(hand_verts_idx), 3),
+            dtype=body_vertices.detach()[:0].cpu().numpy().dtype,
+        )
+        gather_hand_vertices(body_vertices, hand_verts_idx, out, chunk_size)
+        vertex_arrays[name] = out
+
+    for name, path in zip(pc2_names, pc2_paths):
+        write_pc2(path, vertex_arrays[name], num_frames, chunk_size)
+
+    # closed hand faces only depend on the MANO topology and are shared by all sequences
+    face_ids_path = get_smplx_model_files(gender)[-1]
+    topology_id = ensure_hand_topology(cache_dir, face_ids_path, lambda: (
+        hand_model_left.hand_faces.detach().cpu().numpy(),
+        hand_model_right.hand_faces.detach().cpu().numpy(),
+    ))
+
+    writer.commit(
         num_frames=num_frames,
-        output_p1_hand_left_verts=p1_hand_left_verts,
-        output_p1_hand_right_verts=p1_hand_right_verts,
-        output_p2_hand_left_verts=p2_hand_left_verts,
-        output_p2_hand_right_verts=p2_hand_right_verts,
         output_p1_joints=p1_joints,
         output_p2_joints=p2_joints,
-        input_p1_hand_left_verts=input_p1_hand_left_verts,
-        input_p2_hand_left_verts=input_p2_hand_left_verts,
-        input_p1_hand_right_verts=input_p1_hand_right_verts,
-        input_p2_hand_right_verts=input_p2_hand_right_verts,
         input_p1_joints=input_p1_joints,
         input_p2_joints=input_p2_joints,
-        hand_left_faces=hand_left_faces,
-        hand_right_faces=hand_right_faces,
+        topology_id=topology_id,
         obj_verts=obj_verts,
         obj_faces=obj_faces,
-        allow_pickle=True  # for potential lists/objects; adjust as required
+    )
+    write_manifest(
+        save_path, cache_key, cache_inputs, pkl_path,
+        dependencies=[get_topology_path(cache_dir, topology_id).relative_to(cache_dir)] + pc2_dependencies,
     )
\ No newline at end of file
@@ -1,7 +1,8 @@
 import torch
 
-def safe_load_pkl(path):
-	device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+def safe_load_pkl(path, device=None):
+	if device is None:
+		device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
 	
 	try:
 		data = torch.load(path, map_location=device, weights_only=False)
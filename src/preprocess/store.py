@@ -0,0 +1,106 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+# "npz": single zlib-compressed archive, "npy": directory of raw .npy files (memory-mappable)
+INTERMEDIATE_FORMATS = ("npy", "npz")
+
+def get_intermediate_path(cache_dir, stem, store_format):
+    """Location of the intermediate data for a sequence, e.g. cache/seq.npz or cache/seq/"""
+    if store_format == "npz":
+        return Path(cache_dir) / f"{stem}.npz"
+    if store_format == "npy":
+        return Path(cache_dir) / stem
+    raise ValueError(f"Unknown intermediate format {store_format}")
+
+class IntermediateWriter:
+    """
+    Build intermediate data incrementally.
+
+    Large arrays are preallocated with `allocate` and filled in place, as
+    memory-mapped .npy files for directory stores, so long sequences can be
+    streamed chunk by chunk with bounded memory. `commit` adds the remaining
+    arrays and publishes the result at `save_path`.
+    """
+    def __init__(self, save_path):
+        self.save_path = Path(save_path)
+        self.is_npz = self.save_path.suffix == ".npz"
+        self.arrays = {}
+        if not self.is_npz:
+            # Write into a scratch directory and swap it in, so readers never see a partial store
+            self.tmp_path = self.save_path.with_name(self.save_path.name + ".tmp")
+            if self.tmp_path.exists():
+                shutil.rmtree(self.tmp_path)
+            self.tmp_path.mkdir(parents=True)
+
+    def allocate(self, name, shape, dtype=np.float32):
+        if self.is_npz:
+            array = np.empty(shape, dtype=dtype)
+        else:
+            array = np.lib.format.open_memmap(self.tmp_path / f"{name}.npy", mode="w+", dtype=dtype, shape=shape)
+        self.arrays[name] = array
+        return array
+
+    def commit(self, **arrays):
+        if self.is_npz:
+            # Save data in numpy 1.23 compatibility format:
+            np.savez_compressed(
+                self.save_path,
+                **self.arrays,
+                **arrays,
+                allow_pickle=True  # for potential lists/objects; adjust as required
+            )
+            return
+
+        for array in self.arrays.values():
+            array.flush()
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            if array.dtype != object:
+                array = np.require(array, requirements="C")
+            np.save(self.tmp_path / f"{name}.npy", array, allow_pickle=array.dtype == object)
+        self.arrays = {}
+        if self.save_path.exists():
+            shutil.rmtree(self.save_path)
+        os.replace(self.tmp_path, self.save_path)
+
+def save_intermediate(save_path, **arrays):
+    """Write arrays as an npz archive (path ends with .npz) or as a directory of .npy files"""
+    IntermediateWriter(save_path).commit(**arrays)
+
+class NpyStore:
+    """
+    Read-only mapping over a directory of .npy files.
+    Arrays are opened lazily with mmap_mode='r', so slicing a few frames
+    only touches the pages holding those frames.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self._arrays = {}
+
+    def keys(self):
+        return sorted(p.stem for p in self.path.glob("*.npy"))
+
+    def __contains__(self, key):
+        return (self.path / f"{key}.npy").exists()
+
+    def __getitem__(self, key):
+        if key not in self._arrays:
+            array_path = self.path / f"{key}.npy"
+            if not array_path.exists():
+                raise KeyError(key)
+            try:
+                self._arrays[key] = np.load(array_path, mmap_mode="r")
+            except ValueError:
+                # object arrays can't be memory-mapped
+                self._arrays[key] = np.load(array_path, allow_pickle=True)
+        return self._arrays[key]
+
+def load_intermediate(path):
+    """Open intermediate data written by `save_intermediate`"""
+    path = Path(path)
+    if path.is_dir():
+        return NpyStore(path)
+    return np.load(path)
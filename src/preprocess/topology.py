@@ -0,0 +1,76 @@
+"""
+Closed MANO hand topologies.
+
+The closed left/right hand faces only depend on the MANO topology in
+MANO_SMPLX_face_ids.pkl, so they are computed once and cached as a small
+versioned asset under <cache>/topology/. Intermediate data only stores the
+topology ID.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+from .cache import file_digest
+from .close_surface import close_surface
+
+# Bump when the way hand meshes are closed changes
+TOPOLOGY_VERSION = 1
+TOPOLOGY_DIR = "topology"
+
+def get_topology_id(source_digest):
+    """Versioned ID of the closed hand topology built from a face table with sha256 `source_digest`"""
+    return f"mano_closed_v{TOPOLOGY_VERSION}_{source_digest[:16]}"
+
+def get_topology_path(cache_dir, topology_id):
+    return Path(cache_dir) / TOPOLOGY_DIR / f"{topology_id}.npz"
+
+def load_topology(cache_dir, topology_id):
+    """Closed (left, right) hand faces of a cached topology"""
+    with np.load(get_topology_path(cache_dir, topology_id)) as data:
+        return data["hand_left_faces"], data["hand_right_faces"]
+
+def ensure_hand_topology(cache_dir, face_ids_path, get_hand_faces):
+    """
+    Make sure the closed hand topology for `face_ids_path` is cached.
+
+    `get_hand_faces` returns the open (left, right) MANO faces and is only
+    called when the topology has to be built. The cached file is rebuilt
+    when its recorded hash does not match `face_ids_path`.
+
+    Returns
+    -------
+    topology_id: str
+    """
+    source_digest = file_digest(face_ids_path)
+    topology_id = get_topology_id(source_digest)
+    topology_path = get_topology_path(cache_dir, topology_id)
+    if topology_path.exists():
+        with np.load(topology_path) as data:
+            if str(data["source_sha256"]) == source_digest:
+                return topology_id
+
+    hand_left_faces, hand_right_faces = get_hand_faces()
+    topology_path.parent.mkdir(parents=True, exist_ok=True)
+    # Preprocessing processes of a batch may build the topology at the same time
+    tmp_path = topology_path.with_name(f"{topology_path.stem}.{os.getpid()}.tmp.npz")
+    np.savez(
+        tmp_path,
+        hand_left_faces=close_surface(hand_left_faces),
+        hand_right_faces=close_surface(hand_right_faces),
+        source_sha256=source_digest,
+        version=TOPOLOGY_VERSION,
+    )
+    os.replace(tmp_path, topology_path)
+    return topology_id
+
+def load_hand_faces(data, data_path):
+    """
+    Closed (left, right) hand faces for intermediate `data` loaded from `data_path`.
+    Older intermediates store the faces inline, newer ones reference a cached topology.
+    """
+    if "topology_id" not in data:
+        return data["hand_left_faces"], data["hand_right_faces"]
+    topology_id = np.asarray(data["topology_id"]).item()
+    return load_topology(Path(data_path).parent, topology_id)
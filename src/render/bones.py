@@ -7,42 +7,141 @@ def interpolate(a, b, t):
 
 def dir(a, b):
   dir = b - a
-  dir = dir / np.linalg.norm(dir, axis=1)[:, None]
+  dir = dir / np.linalg.norm(dir, axis=-1, keepdims=True)
   return dir
 
+def stack_person_major(arrays, people):
+  """Stack per-primitive (frames, ...) or (people, frames, ...) arrays to (people * primitives, frames, ...)"""
+  stacked = np.stack([np.broadcast_to(array, (people,) + array.shape[-2:]) for array in arrays], axis=1)
+  return stacked.reshape((-1,) + stacked.shape[2:])
+
+def axis_angle_from_z(direction, eps=1e-8):
+  """
+  Axis-angle (..., 4) rotating the z axis onto `direction` (..., 3).
+  The axis is z x direction, left unnormalized as Blender normalizes it.
+  Directions along z have no such axis: +z is no rotation, -z a half turn about x.
+  """
+  axis = np.stack([-direction[..., 1], direction[..., 0], np.zeros_like(direction[..., 2])], axis=-1)
+  sin = np.linalg.norm(axis, axis=-1)
+  angle = np.arctan2(sin, direction[..., 2])
+  degenerate = ~(sin > eps)
+  axis[degenerate] = (1, 0, 0)
+  angle[degenerate] = np.where(direction[degenerate][:, 2] < 0, np.pi, 0)
+  return np.concatenate([angle[..., None], axis], axis=-1)
+
+def axis_angle_to_euler(axis_angle, eps=1e-8):
+  """
+  XYZ euler angles (..., 3) of axis-angle rotations (..., 4), as Blender converts them.
+  Zero axes are treated as no rotation.
+  """
+  angle = axis_angle[..., 0]
+  axis = axis_angle[..., 1:]
+  norm = np.linalg.norm(axis, axis=-1, keepdims=True)
+  axis = np.where(norm > eps, axis / np.where(norm > eps, norm, 1), (1, 0, 0))
+  angle = np.where(norm[..., 0] > eps, angle, 0)
+  
+  # Rodrigues' rotation formula
+  x, y, z = axis[..., 0], axis[..., 1], axis[..., 2]
+  c, s = np.cos(angle), np.sin(angle)
+  t = 1 - c
+  r00, r10, r20 = t * x * x + c, t * x * y + s * z, t * x * z - s * y
+  r11, r21 = t * y * y + c, t * y * z + s * x
+  r12, r22 = t * y * z - s * x, t * z * z + c
+  
+  cy = np.hypot(r00, r10)
+  gimbal = cy <= 16 * np.finfo(np.float32).eps
+  euler = np.stack([
+    np.where(gimbal, np.arctan2(-r12, r11), np.arctan2(r21, r22)),
+    np.arctan2(-r20, cy),
+    np.where(gimbal, 0, np.arctan2(r10, r00)),
+  ], axis=-1)
+  return euler
+
 class Bones:
   def __init__(self, joints: np.ndarray):
     """
-    joints: (frames, 22, 3)
+    joints: (frames, 22, 3) or (people, frames, 22, 3)
+    
+    Every derived point is computed for all people at once. Primitives of all
+    people are stacked person-major, `sphere_person_ids` and `cylinder_person_ids`
+    give the person each primitive belongs to.
+    
+    Spheres placed on the same joint array are merged into the largest one,
+    which encloses the others.
+    
+    Primitives are stored as stacked float32 arrays, `spheres` and `cylinders`
+    are views over them:
+    sphere_positions: (spheres, frames, 3)
+    sphere_radii: (spheres, )
+    sphere_color_ids: (spheres, )
+    cylinder_positions: (cylinders, frames, 3)
+    cylinder_directions: (cylinders, frames, 3)
+    cylinder_heights: (cylinders, frames)
+    cylinder_radii: (cylinders, )
+    cylinder_color_ids: (cylinders, )
+    cylinder_axis_angles: (cylinders, frames, 4) rotation of the z aligned cylinder mesh
+    cylinder_scales: (cylinders, frames, 3) stretches the mesh of height 2 to the bone length
     """
-    self.frames = joints.shape[0]
-    self.spheres: list[Sphere] = []
-    self.cylinders: list[Cylinder] = []
+    self.people = joints.shape[0] if joints.ndim == 4 else 1
+    self.frames = joints.shape[-3]
+    # (color_id, pos, radius) and (color_id, tails, heads, radius) until stacked
+    self.sphere_sources = []
+    self.cylinder_sources = []
+    self.sphere_index: dict[int, int] = {}
     self.set_bones(joints)
+    self.stack_primitives()
+    
+  def stack_primitives(self):
+    people = self.people
+    num_spheres = len(self.sphere_sources)
+    num_cylinders = len(self.cylinder_sources)
+    
+    self.sphere_positions = stack_person_major([pos for _, pos, _ in self.sphere_sources], people).astype(np.float32)
+    self.sphere_radii = np.tile(np.array([radius for _, _, radius in self.sphere_sources], dtype=np.float32), people)
+    self.sphere_color_ids = np.tile(np.array([color_id for color_id, _, _ in self.sphere_sources]), people)
+    self.sphere_person_ids = np.repeat(np.arange(people), num_spheres)
+    
+    tails = stack_person_major([tails for _, tails, _, _ in self.cylinder_sources], people).astype(np.float32)
+    heads = stack_person_major([heads for _, _, heads, _ in self.cylinder_sources], people).astype(np.float32)
+    self.cylinder_positions = (tails + heads) / 2
+    self.cylinder_directions = heads - tails
+    self.cylinder_heights = np.linalg.norm(self.cylinder_directions, axis=-1)
+    self.cylinder_directions /= self.cylinder_heights[..., None]
+    self.cylinder_radii = np.tile(np.array([radius for _, _, _, radius in self.cylinder_sources], dtype=np.float32), people)
+    self.cylinder_color_ids = np.tile(np.array([color_id for color_id, _, _, _ in self.cylinder_sources]), people)
+    self.cylinder_person_ids = np.repeat(np.arange(people), num_cylinders)
+    self.cylinder_axis_angles = axis_angle_from_z(self.cylinder_directions)
+    self.cylinder_scales = np.ones(self.cylinder_directions.shape, dtype=np.float32)
+    self.cylinder_scales[..., 2] = self.cylinder_heights / 2
+    
+    self.sphere_sources = []
+    self.cylinder_sources = []
+    self.spheres = [Sphere(self, i) for i in range(len(self.sphere_radii))]
+    self.cylinders = [Cylinder(self, i) for i in range(len(self.cylinder_radii))]
     
   def set_bones(self, joints):
-    pelvis = joints[:,JOINT_GLOBAL]
-    left_hip = joints[:,JOINT_LEFT_HIP]
-    right_hip = joints[:,JOINT_RIGHT_HIP]
-    spine1 = joints[:,JOINT_SPINE1]
-    left_knee = joints[:,JOINT_LEFT_KNEE]
-    right_knee = joints[:,JOINT_RIGHT_KNEE]
-    spine2 = joints[:,JOINT_SPINE2]
-    left_ankle = joints[:,JOINT_LEFT_ANKLE]
-    right_ankle = joints[:,JOINT_RIGHT_ANKLE]
-    spine3 = joints[:,JOINT_SPINE3]
-    left_toe = joints[:,JOINT_LEFT_TOE]
-    right_toe = joints[:,JOINT_RIGHT_TOE]
-    neck = joints[:,JOINT_NECK]
-    head = joints[:,JOINT_HEAD]
-    left_collar = joints[:,JOINT_LEFT_COLLAR]
-    right_collar = joints[:,JOINT_RIGHT_COLLAR]
-    left_shoulder = joints[:,JOINT_LEFT_SHOULDER]
-    right_shoulder = joints[:,JOINT_RIGHT_SHOULDER]
-    left_elbow = joints[:,JOINT_LEFT_ELBOW]
-    right_elbow = joints[:,JOINT_RIGHT_ELBOW]
-    left_wrist = joints[:,JOINT_LEFT_WRIST]
-    right_wrist = joints[:,JOINT_RIGHT_WRIST]
+    pelvis = joints[...,JOINT_GLOBAL,:]
+    left_hip = joints[...,JOINT_LEFT_HIP,:]
+    right_hip = joints[...,JOINT_RIGHT_HIP,:]
+    spine1 = joints[...,JOINT_SPINE1,:]
+    left_knee = joints[...,JOINT_LEFT_KNEE,:]
+    right_knee = joints[...,JOINT_RIGHT_KNEE,:]
+    spine2 = joints[...,JOINT_SPINE2,:]
+    left_ankle = joints[...,JOINT_LEFT_ANKLE,:]
+    right_ankle = joints[...,JOINT_RIGHT_ANKLE,:]
+    spine3 = joints[...,JOINT_SPINE3,:]
+    left_toe = joints[...,JOINT_LEFT_TOE,:]
+    right_toe = joints[...,JOINT_RIGHT_TOE,:]
+    neck = joints[...,JOINT_NECK,:]
+    head = joints[...,JOINT_HEAD,:]
+    left_collar = joints[...,JOINT_LEFT_COLLAR,:]
+    right_collar = joints[...,JOINT_RIGHT_COLLAR,:]
+    left_shoulder = joints[...,JOINT_LEFT_SHOULDER,:]
+    right_shoulder = joints[...,JOINT_RIGHT_SHOULDER,:]
+    left_elbow = joints[...,JOINT_LEFT_ELBOW,:]
+    right_elbow = joints[...,JOINT_RIGHT_ELBOW,:]
+    left_wrist = joints[...,JOINT_LEFT_WRIST,:]
+    right_wrist = joints[...,JOINT_RIGHT_WRIST,:]
     
     left_shin = interpolate(left_knee, left_ankle, 0.4)
     right_shin = interpolate(right_knee, right_ankle, 0.4)
@@ -136,51 +235,98 @@ class Bones:
     
     self.add_bone(COLOR_SKIN, chest, chin, neck_size)
     
-    if joints.shape[1] == 24:
+    if joints.shape[-2] == 24:
       palm_size = 0.04 
-      left_palm = joints[:,JOINT_LEFT_PALM]
-      right_palm = joints[:,JOINT_RIGHT_PALM]
-      left_direction = (left_palm - left_wrist) / np.linalg.norm(left_palm - left_wrist, axis=1, keepdims=True)
+      left_palm = joints[...,JOINT_LEFT_PALM,:]
+      right_palm = joints[...,JOINT_RIGHT_PALM,:]
+      left_direction = (left_palm - left_wrist) / np.linalg.norm(left_palm - left_wrist, axis=-1, keepdims=True)
       left_wrist_adjusted = left_wrist + left_direction * 0.025
       self.add_sphere(COLOR_SKIN, left_wrist_adjusted, palm_size)
 
-      right_direction = (right_palm - right_wrist) / np.linalg.norm(right_palm - right_wrist, axis=1, keepdims=True)
+      right_direction = (right_palm - right_wrist) / np.linalg.norm(right_palm - right_wrist, axis=-1, keepdims=True)
       right_wrist_adjusted = right_wrist + right_direction * 0.025
       self.add_sphere(COLOR_SKIN, right_wrist_adjusted, palm_size)
     
   def add_bone(self, color_id, tails, heads, radius=0.05):
-    bones_pos = (tails + heads) / 2
-    bones_dir = heads - tails
-    bones_len = np.linalg.norm(bones_dir, axis=1)
-    bones_dir = bones_dir / bones_len[:, None]
-    
-    self.spheres.append(Sphere(color_id, tails, r=radius))
-    self.spheres.append(Sphere(color_id, heads, r=radius))
-    self.cylinders.append(Cylinder(color_id, bones_pos, direction=bones_dir, height=bones_len, r=radius))
+    self.add_sphere(color_id, tails, radius)
+    self.add_sphere(color_id, heads, radius)
+    self.cylinder_sources.append((color_id, tails, heads, radius))
   
   def add_sphere(self, color_id, pos: np.ndarray, radius: float = 0.05):
-    self.spheres.append(Sphere(color_id, pos, r=radius))
+    # Joints shared by several bones pass the same array, keep the largest sphere there
+    index = self.sphere_index.get(id(pos))
+    if index is None:
+      self.sphere_index[id(pos)] = len(self.sphere_sources)
+      self.sphere_sources.append((color_id, pos, radius))
+    elif radius > self.sphere_sources[index][2]:
+      self.sphere_sources[index] = (color_id, pos, radius)
 
 class Sphere:
-  def __init__(self, color_id, pos: np.ndarray, r: float = 0.05):
-    """
-    pos: (frames, 3)
-    r: float
-    """
-    self.color_id = color_id
-    self.pos = pos
-    self.r = r
+  """View of sphere `index` of `bones`"""
+  __slots__ = ("bones", "index")
+  
+  def __init__(self, bones: Bones, index: int):
+    self.bones = bones
+    self.index = index
+  
+  @property
+  def color_id(self):
+    return self.bones.sphere_color_ids[self.index]
+  
+  @property
+  def person(self):
+    return self.bones.sphere_person_ids[self.index]
+  
+  @property
+  def pos(self):
+    """(frames, 3)"""
+    return self.bones.sphere_positions[self.index]
+  
+  @property
+  def r(self):
+    return self.bones.sphere_radii[self.index]
 
 class Cylinder:
-  def __init__(self, color_id, pos: np.ndarray, direction: np.ndarray, height: np.ndarray, r: float = 0.05):
-    """
-    pos: (frames, 3)
-    direction: (frames, 3)
-    height: (frames, )
-    r: float
-    """
-    self.color_id = color_id
-    self.pos = pos
-    self.direction = direction
-    self.r = r
-    self.height = height
\ No newline at end of file
+  """View of cylinder `index` of `bones`"""
+  __slots__ = ("bones", "index")
+  
+  def __init__(self, bones: Bones, index: int):
+    self.bones = bones
+    self.index = index
+  
+  @property
+  def color_id(self):
+    return self.bones.cylinder_color_ids[self.index]
+  
+  @property
+  def person(self):
+    return self.bones.cylinder_person_ids[self.index]
+  
+  @property
+  def pos(self):
+    """(frames, 3)"""
+    return self.bones.cylinder_positions[self.index]
+  
+  @property
+  def direction(self):
+    """(frames, 3)"""
+    return self.bones.cylinder_directions[self.index]
+  
+  @property
+  def height(self):
+    """(frames, )"""
+    return self.bones.cylinder_heights[self.index]
+  
+  @property
+  def r(self):
+    return self.bones.cylinder_radii[self.index]
+  
+  @property
+  def axis_angle(self):
+    """(frames, 4)"""
+    return self.bones.cylinder_axis_angles[self.index]
+  
+  @property
+  def scale(self):
+    """(frames, 3)"""
+    return self.bones.cylinder_scales[self.index]
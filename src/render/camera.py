@@ -36,6 +36,8 @@ def get_camera_params(camera_no):
         [200,    "cam04"],
         [160,    "cam05"],
     ]
+    if isinstance(camera_no, (list, tuple)):
+        return [param for no in camera_no for param in get_camera_params(no)]
     if camera_no == -1: # all cameras
         return camera_params
     elif camera_no < len(camera_params):
@@ -0,0 +1,63 @@
+"""
+Client of the render server (render/server.py), free of bpy so it runs outside Blender.
+
+    python src/render/client.py -p 5577 5578 -- -i cache/sample -o output/sample/eevee_sc0_output
+
+The job is sent to the first idle server of the given ports, waiting while all are busy.
+"""
+
+import argparse
+import json
+import re
+import socket
+import sys
+import time
+
+# Printed by a server once it listens, with the port it was given when started with port 0
+LISTENING_MESSAGE = "Render server listening on {host}:{port}"
+LISTENING_PATTERN = re.compile(r"Render server listening on (\S+):(\d+)")
+
+def request(port, message, host="127.0.0.1", timeout=None):
+    """Send one JSON message and wait for the reply, at most `timeout` seconds if given"""
+    with socket.create_connection((host, port), timeout=timeout) as conn:
+        conn.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        with conn.makefile("r", encoding="utf-8") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError(f"Render server on port {port} closed the connection")
+    return json.loads(line)
+
+def send_job(ports, argv, host="127.0.0.1", poll_interval=0.5):
+    """Render `argv` on the first idle server, raises RuntimeError if the job failed"""
+    while True:
+        for port in ports:
+            reply = request(port, {"argv": list(argv)}, host)
+            if reply.get("busy"):
+                continue
+            if not reply.get("ok"):
+                raise RuntimeError(f"Render job failed on port {port}:\n{reply.get('error')}")
+            return port
+        time.sleep(poll_interval)
+
+def shutdown_server(port, host="127.0.0.1", timeout=60):
+    """Ask an idle server to exit, raises OSError if it does not reply within `timeout` seconds"""
+    request(port, {"shutdown": True}, host, timeout)
+
+def main():
+    argv = sys.argv[1:]
+    job_argv = []
+    if "--" in argv:
+        argv, job_argv = argv[:argv.index("--")], argv[argv.index("--") + 1:]
+    parser = argparse.ArgumentParser(description='Send a render.py job to a render server')
+    parser.add_argument('-p', '--port', type=int, nargs='+', required=True)
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    args = parser.parse_args(argv)
+    try:
+        port = send_job(args.port, job_argv, args.host)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print(f"Rendered on port {port}")
+
+if __name__ == "__main__":
+    main()
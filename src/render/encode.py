@@ -0,0 +1,45 @@
+"""
+Encoding of sharded renders, free of bpy so it runs outside Blender.
+
+    python src/render/encode.py output/sample/eevee_sc0_output_cam00_frames output/sample/eevee_sc0_output_cam000001-0021.mp4 21
+
+The PNG frames every shard of a camera rendered are concatenated into one
+H.264 MP4 with ffmpeg, then the frames directory is removed.
+"""
+
+import argparse
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+def encode_frames(frames_dir, video_file, num_frames, fps=30):
+    """Encode `frames_dir`/0001.png, ... into `video_file`, raises RuntimeError if frames are missing"""
+    frames_dir = Path(frames_dir)
+    frames = sorted(frames_dir.glob("*.png"))
+    if len(frames) != num_frames:
+        raise RuntimeError(f"{frames_dir} has {len(frames)} of {num_frames} frames")
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-framerate", str(fps), "-start_number", "1", "-i", str(frames_dir / "%04d.png"),
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", str(video_file),
+    ]
+    subprocess.run(cmd, check=True)
+    shutil.rmtree(frames_dir)
+    print(f"Saved to {video_file}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Encode the PNG frames of a sharded render into one video')
+    parser.add_argument('frames_dir', type=str)
+    parser.add_argument('video_file', type=str)
+    parser.add_argument('num_frames', type=int)
+    parser.add_argument('--fps', type=int, default=30)
+    args = parser.parse_args()
+    try:
+        encode_frames(args.frames_dir, args.video_file, args.num_frames, args.fps)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,77 +1,116 @@
+import os
 import bpy
+import bmesh
+from bpy.app.handlers import persistent
 import numpy as np
 
-from render.bones import Bones
+from render.bones import Bones, axis_angle_to_euler
+from render.utils import insert_keyframes
+from preprocess.pc2 import read_pc2_frame
 from render.index import COLOR_CLOTH, COLOR_PANTS, COLOR_SKIN
 
-def create_mesh_for_frame(verts, faces, frame_num, material):
-    """Create mesh object for a specific frame"""
-    # Create new mesh datablock
-    mesh = bpy.data.meshes.new(f"Frame_{frame_num}_mesh")
-    obj = bpy.data.objects.new(f"Frame_{frame_num}", mesh)
+# Meshes driven by `update_mesh_animations`: (mesh, (T, V, 3) vertex history, upsample)
+mesh_animations = []
+# Instancing point clouds driven by `update_mesh_animations`:
+# (mesh, (T, N, 3) positions, (T, N, 4) axis-angles, (T, N, 3) scales, upsample)
+instance_animations = []
 
-    # Create mesh from vertices and faces
-    mesh.from_pydata(verts, [], faces)
+def create_mesh_for_frame(verts, faces, frame_num, material, template=None):
+    """Create mesh object for a specific frame, copying the mesh of `template` if given"""
+    name = f"Frame_{frame_num}"
+    if template is None:
+        return create_mesh_object(verts, faces, name, material)
+    # Frames of an actor share faces and material, only the vertex positions change
+    mesh = template.copy()
+    mesh.name = f"{name}_mesh"
+    mesh.vertices.foreach_set("co", np.asarray(verts, dtype=np.float32).ravel())
     mesh.update()
-    
-    # Link object to scene
+    return link_mesh_object(mesh, name)
+
+def create_mesh(verts, faces, name):
+    """
+    Smooth shaded mesh datablock from (V, 3) vertices and (F, K) faces.
+    Vertices, loops and polygons are allocated once and filled from NumPy
+    buffers with foreach_set, instead of Python sequences with from_pydata.
+    """
+    verts = np.asarray(verts, dtype=np.float32)
+    faces = np.asarray(faces, dtype=np.int32)
+    num_faces, face_size = faces.shape
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set("co", verts.ravel())
+    mesh.loops.add(faces.size)
+    mesh.loops.foreach_set("vertex_index", faces.ravel())
+    mesh.polygons.add(num_faces)
+    mesh.polygons.foreach_set("loop_start", np.arange(0, faces.size, face_size, dtype=np.int32))
+    # Derived from loop_start since Blender 4.0
+    if not bpy.types.MeshPolygon.bl_rna.properties["loop_total"].is_readonly:
+        mesh.polygons.foreach_set("loop_total", np.full(num_faces, face_size, dtype=np.int32))
+    mesh.polygons.foreach_set("use_smooth", np.ones(num_faces, dtype=bool))
+    mesh.update(calc_edges=True)
+    return mesh
+
+def create_mesh_object(verts, faces, name, material):
+    """Create mesh object from vertices and faces"""
+    mesh = create_mesh(verts, faces, f"{name}_mesh")
+    mesh.materials.append(bpy.data.materials[material])
+    return link_mesh_object(mesh, name)
+
+def link_mesh_object(mesh, name):
+    obj = bpy.data.objects.new(name, mesh)
     bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+def get_primitive_mesh(shape):
+    """
+    Unit mesh shared by all primitives of `shape`, built once and kept in the .blend.
+    sphere: UV sphere of radius 1, cylinder: capless cylinder of radius 1 and depth 2 along z,
+    same resolution as the primitive_uv_sphere_add / primitive_cylinder_add defaults.
+    """
+    name = f"Unit_{shape.capitalize()}"
+    mesh = bpy.data.meshes.get(name)
+    if mesh is not None:
+        return mesh
     
-    # Add material
-    obj.data.materials.append(bpy.data.materials[material])
+    bm = bmesh.new()
+    bm.loops.layers.uv.new()
+    if shape == "sphere":
+        bmesh.ops.create_uvsphere(bm, u_segments=32, v_segments=16, radius=1, calc_uvs=True)
+    else:
+        bmesh.ops.create_cone(bm, cap_ends=False, segments=32, radius1=1, radius2=1, depth=2, calc_uvs=True)
+    for face in bm.faces:
+        face.smooth = True
+    mesh = bpy.data.meshes.new(name)
+    bm.to_mesh(mesh)
+    bm.free()
     
-    # Smooth shading
-    with bpy.context.temp_override(selected_editable_objects=[obj]):
-        bpy.ops.object.shade_smooth()
-        
+    # Material is linked per object
+    mesh.materials.append(None)
+    mesh.use_fake_user = True
+    return mesh
+
+def create_primitive(shape, material, name):
+    """Object sharing the unit mesh of `shape`, with its own `material`"""
+    obj = bpy.data.objects.new(name, get_primitive_mesh(shape))
+    bpy.context.collection.objects.link(obj)
+    obj.material_slots[0].link = 'OBJECT'
+    obj.material_slots[0].material = bpy.data.materials[material]
     return obj
 
 def create_sphere(material, radius=0.05):
-    """Create sphere object for joint visualization"""
-    # Set different radius for each joint
-    bpy.ops.mesh.primitive_uv_sphere_add(radius=radius)
-    sphere = bpy.context.active_object
-    sphere.data.materials.append(bpy.data.materials[material])
-    with bpy.context.temp_override(selected_editable_objects=[sphere]):
-        bpy.ops.object.shade_smooth()
-        
+    """Create sphere object for joint visualization, the unit sphere is scaled by `radius`"""
+    sphere = create_primitive("sphere", material, "Sphere")
+    sphere.scale = (radius, radius, radius)
     return sphere
 
 def create_cylinder(material, radius=0.05):
-    """Create a cylinder object connecting two joints to represent a bone (side surface only, no end caps)"""
-    # Create cylinder
-    bpy.ops.mesh.primitive_cylinder_add(radius=radius)
-    cylinder = bpy.context.active_object
-    
-    # Remove end cap faces, keep only side surface
-    # Select end cap faces by checking their normals (they point along Z axis)
-    bpy.ops.object.mode_set(mode='OBJECT')
-    mesh = cylinder.data
-    
-    # Deselect all faces first
-    for face in mesh.polygons:
-        face.select = False
-    
-    # Select faces with normals aligned with Z axis (end caps)
-    for face in mesh.polygons:
-        if abs(face.normal.z) > 0.9:  # End cap (normal mostly along Z axis)
-            face.select = True
-    
-    # Switch to edit mode and delete selected end cap faces
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.mesh.delete(type='FACE')
-    
-    # Add loop cuts to sides for better subdivision
-    bpy.ops.mesh.select_all(action='SELECT')
-    bpy.ops.object.mode_set(mode='OBJECT')
-    
-    # Add material
-    cylinder.data.materials.append(bpy.data.materials[material])
-    
-    # Smooth shading
-    with bpy.context.temp_override(selected_editable_objects=[cylinder]):
-        bpy.ops.object.shade_smooth()
-    
+    """
+    Create a cylinder object connecting two joints to represent a bone (side surface only, no end caps).
+    The unit cylinder is scaled by `radius` in x and y, and by half the bone length in z.
+    """
+    cylinder = create_primitive("cylinder", material, "Cylinder")
+    cylinder.scale = (radius, radius, 1)
     return cylinder
 
 def setup_keyframe(obj, frame_num):
@@ -94,66 +133,270 @@ def setup_keyframe(obj, frame_num):
     obj.keyframe_insert(data_path="hide_render", frame=frame_num + 1)
     obj.keyframe_insert(data_path="hide_viewport", frame=frame_num + 1)
 
-def setup_mesh_keyframes(verts_list, obj_faces_list, material):
-    """Create mesh objects for each frame"""
-    for frame_num in range(1, len(verts_list)*2):
+def get_anim_frames(num_frames, upsample=2):
+    """Number of animation frames of `num_frames` base frames, `upsample` animation frames apart"""
+    return (num_frames - 1) * upsample + 1
+
+def setup_mesh_keyframes(verts_list, obj_faces_list, material, upsample=2):
+    """
+    Create mesh objects for each animation frame, in-between frames are
+    materialized, so scene memory grows with `upsample`
+    """
+    template = None
+    for frame_num in range(1, get_anim_frames(len(verts_list), upsample) + 1):
         # Create mesh for the frame
-        if frame_num % 2 == 1:
-            verts = verts_list[frame_num//2]
-        else:
-            verts = (verts_list[frame_num//2-1] + verts_list[frame_num//2]) / 2
-        obj = create_mesh_for_frame(verts, obj_faces_list, frame_num, material)
+        verts = frame_vertices(verts_list, frame_num, upsample)
+        obj = create_mesh_for_frame(verts, obj_faces_list, frame_num, material, template)
+        template = template or obj.data
         setup_keyframe(obj, frame_num)
 
-def setup_sphere_keyframes(sphere, pos):
+def frame_vertices(verts_list, anim_frame, upsample=2):
+    """
+    Vertices at an animation frame, base frame i is shown at frame `upsample`*i+1
+    and in-between frames are linearly interpolated
+    """
+    t = min(max((anim_frame - 1) / upsample, 0), len(verts_list) - 1)
+    i = int(t)
+    w = t - i
+    if w == 0:
+        return verts_list[i]
+    return verts_list[i] * (1 - w) + verts_list[i + 1] * w
+
+@persistent
+def update_mesh_animations(scene, *args):
+    """frame_change_pre handler moving the vertices of every animated mesh and point cloud"""
+    for mesh, verts_list, upsample in mesh_animations:
+        verts = np.asarray(frame_vertices(verts_list, scene.frame_current, upsample), dtype=np.float32)
+        mesh.vertices.foreach_set("co", verts.ravel())
+        mesh.update()
+    for mesh, positions, axis_angles, scales, upsample in instance_animations:
+        set_instance_attributes(
+            mesh,
+            frame_vertices(positions, scene.frame_current, upsample),
+            frame_vertices(axis_angles, scene.frame_current, upsample),
+            frame_vertices(scales, scene.frame_current, upsample),
+        )
+
+def register_mesh_animations():
+    if update_mesh_animations not in bpy.app.handlers.frame_change_pre:
+        bpy.app.handlers.frame_change_pre.append(update_mesh_animations)
+    # Rendering must not run concurrently with the handler editing mesh data
+    bpy.context.scene.render.use_lock_interface = True
+
+def clear_mesh_animations():
+    mesh_animations.clear()
+    instance_animations.clear()
+    if update_mesh_animations in bpy.app.handlers.frame_change_pre:
+        bpy.app.handlers.frame_change_pre.remove(update_mesh_animations)
+
+def setup_mesh_animation(verts_list, faces, material, name="Mesh", upsample=2):
+    """
+    Create a single mesh object whose vertex positions follow `verts_list`.
+    Vertices are updated by a frame change handler, so the number of objects
+    and the scene memory do not grow with the number of frames.
+    """
+    obj = create_mesh_object(verts_list[0], faces, name, material)
+    bind_mesh_animation(obj, verts_list, upsample)
+    return obj
+
+def bind_mesh_animation(obj, verts_list, upsample=2):
+    """Drive the mesh of `obj` with `verts_list`, also used for objects of a saved scene"""
+    mesh_animations.append((obj.data, verts_list, upsample))
+    register_mesh_animations()
+
+def setup_mesh_cache(pc2_path, faces, material, name="Mesh", first_sample=0, upsample=2):
+    """
+    Create a single mesh object animated by a Mesh Cache modifier reading `pc2_path`.
+    Sample `first_sample` is shown at frame 1, base frames are `upsample` animation
+    frames apart and in-between frames are linearly interpolated.
+    """
+    obj = create_mesh_object(read_pc2_frame(pc2_path, first_sample), faces, name, material)
+    modifier = obj.modifiers.new("MeshCache", 'MESH_CACHE')
+    modifier.cache_format = 'PC2'
+    modifier.filepath = os.path.abspath(pc2_path)
+    modifier.time_mode = 'FRAME'
+    modifier.play_mode = 'SCENE'
+    modifier.interpolation = 'LINEAR'
+    # The modifier reads sample `frame * frame_scale - frame_start`
+    modifier.frame_scale = 1 / upsample
+    modifier.frame_start = 1 / upsample - first_sample
+    return obj
+
+def setup_sphere_keyframes(sphere, pos, upsample=2):
     frame_num = pos.shape[0]
+    anim_frames = np.arange(frame_num) * upsample + 1
     
-    for frame in range(frame_num):
-        anim_frame = frame * 2 + 1
-        sphere.location = pos[frame]
-        sphere.keyframe_insert(data_path="location", frame=anim_frame)
+    sphere.location = pos[0]
+    insert_keyframes(sphere, "location", anim_frames, pos)
 
-def setup_cylinder_keyframes(cylinder, pos, direction, height):
-    frame_num = direction.shape[0]
+def setup_cylinder_keyframes(cylinder, pos, axis_angle, scale, upsample=2):
+    frame_num = pos.shape[0]
+    anim_frames = np.arange(frame_num) * upsample + 1
     
-    for frame in range(frame_num):
-        anim_frame = frame * 2 + 1
-        
-        z_axis = np.array([0, 0, 1])
-        rotation_axis = np.cross(z_axis, direction[frame])
-        rotation_angle = np.arccos(np.dot(z_axis, direction[frame]))
-        cylinder.scale[2] = height[frame] / 2
-        cylinder.keyframe_insert(data_path="scale", frame=anim_frame)
-        
-        if np.any(rotation_axis):
-            cylinder.rotation_mode = 'AXIS_ANGLE'
-            cylinder.rotation_axis_angle = [rotation_angle] + list(rotation_axis.tolist())
-        
-        cylinder.location = pos[frame]
-        cylinder.keyframe_insert(data_path="location", frame=anim_frame)
-        cylinder.keyframe_insert(data_path="rotation_axis_angle", frame=anim_frame)
+    cylinder.rotation_mode = 'AXIS_ANGLE'
+    cylinder.location = pos[0]
+    insert_keyframes(cylinder, "scale", anim_frames, scale)
+    insert_keyframes(cylinder, "location", anim_frames, pos)
+    insert_keyframes(cylinder, "rotation_axis_angle", anim_frames, axis_angle)
 
-def setup_joints_and_bones(joints, material, clothed):
+def primitive_material(color_id, material, clothed):
+    """Material of a joint or bone, clothed actors show skin and pants colors"""
+    if clothed:
+        if color_id == COLOR_SKIN:
+            return "Skin"
+        elif color_id == COLOR_PANTS:
+            return "Gray"
+    return material
+
+def setup_joints_and_bones(joints, materials, clothed, upsample=2):
+    """
+    joints: (people, frames, J, 3)
+    materials: material of each person
+    upsample: animation frames between keyframed base frames
+    """
     bones = Bones(joints)
     
     for sphere in bones.spheres:
-        cid = sphere.color_id
-        sphere_material = material
-        if clothed:
-            if cid == COLOR_SKIN:
-                sphere_material = "Skin"
-            elif cid == COLOR_PANTS:
-                sphere_material = "Gray"
-        s = create_sphere(sphere_material, sphere.r)
-        setup_sphere_keyframes(s, sphere.pos)
+        s = create_sphere(primitive_material(sphere.color_id, materials[sphere.person], clothed), sphere.r)
+        setup_sphere_keyframes(s, sphere.pos, upsample)
         
     for cylinder in bones.cylinders:
-        cid = cylinder.color_id
-        cylinder_material = material
-        if clothed:
-            if cid == COLOR_SKIN:
-                cylinder_material = "Skin"
-            elif cid == COLOR_PANTS:
-                cylinder_material = "Gray"
-        c = create_cylinder(cylinder_material, cylinder.r)
-        setup_cylinder_keyframes(c, cylinder.pos, cylinder.direction, cylinder.height)
\ No newline at end of file
+        c = create_cylinder(primitive_material(cylinder.color_id, materials[cylinder.person], clothed), cylinder.r)
+        # Radius is part of the scale of the shared unit cylinder
+        scale = cylinder.scale * np.array([cylinder.r, cylinder.r, 1], dtype=np.float32)
+        setup_cylinder_keyframes(c, cylinder.pos, cylinder.axis_angle, scale, upsample)
+
+def create_instancing_node_group(name, materials):
+    """
+    Geometry Nodes group instancing primitives on the points of a mesh.
+    Templates are a UV sphere of radius 1 and a capless cylinder of radius 1 and
+    depth 2, once per material, so template `shape * len(materials) + material`
+    is picked by the `instance_index` point attribute and transformed by the
+    `rotation` (XYZ euler) and `scale` point attributes.
+    """
+    group = bpy.data.node_groups.new(name, 'GeometryNodeTree')
+    group.interface.new_socket("Geometry", in_out='INPUT', socket_type='NodeSocketGeometry')
+    group.interface.new_socket("Geometry", in_out='OUTPUT', socket_type='NodeSocketGeometry')
+    nodes = group.nodes
+    links = group.links
+    group_input = nodes.new('NodeGroupInput')
+    group_output = nodes.new('NodeGroupOutput')
+    
+    # Same resolution as the primitive_uv_sphere_add / primitive_cylinder_add defaults
+    sphere = nodes.new('GeometryNodeMeshUVSphere')
+    sphere.inputs["Segments"].default_value = 32
+    sphere.inputs["Rings"].default_value = 16
+    sphere.inputs["Radius"].default_value = 1
+    cylinder = nodes.new('GeometryNodeMeshCylinder')
+    cylinder.fill_type = 'NONE'
+    cylinder.inputs["Vertices"].default_value = 32
+    cylinder.inputs["Radius"].default_value = 1
+    cylinder.inputs["Depth"].default_value = 2
+    
+    template_outputs = []
+    for shape in (sphere, cylinder):
+        smooth = nodes.new('GeometryNodeSetShadeSmooth')
+        links.new(shape.outputs["Mesh"], smooth.inputs["Geometry"])
+        for material in materials:
+            set_material = nodes.new('GeometryNodeSetMaterial')
+            set_material.inputs["Material"].default_value = bpy.data.materials[material]
+            links.new(smooth.outputs["Geometry"], set_material.inputs["Geometry"])
+            template_outputs.append(set_material.outputs["Geometry"])
+    # Multi-input sockets list the most recent link first
+    templates = nodes.new('GeometryNodeGeometryToInstance')
+    for output in reversed(template_outputs):
+        links.new(output, templates.inputs["Geometry"])
+    
+    instance = nodes.new('GeometryNodeInstanceOnPoints')
+    instance.inputs["Pick Instance"].default_value = True
+    links.new(group_input.outputs["Geometry"], instance.inputs["Points"])
+    links.new(templates.outputs["Instances"], instance.inputs["Instance"])
+    for attribute, data_type, socket in (
+        ("instance_index", 'INT', "Instance Index"),
+        ("rotation", 'FLOAT_VECTOR', "Rotation"),
+        ("scale", 'FLOAT_VECTOR', "Scale"),
+    ):
+        named_attribute = nodes.new('GeometryNodeInputNamedAttribute')
+        named_attribute.data_type = data_type
+        named_attribute.inputs["Name"].default_value = attribute
+        output = next(output for output in named_attribute.outputs if output.enabled)
+        links.new(output, instance.inputs[socket])
+    links.new(instance.outputs["Instances"], group_output.inputs["Geometry"])
+    
+    return group
+
+def set_instance_attributes(mesh, positions, axis_angles, scales):
+    """Move the instancing points of `mesh`, positions (N, 3), axis-angles (N, 4), scales (N, 3)"""
+    rotations = axis_angle_to_euler(np.asarray(axis_angles))
+    mesh.vertices.foreach_set("co", np.asarray(positions, dtype=np.float32).ravel())
+    mesh.attributes["rotation"].data.foreach_set("vector", rotations.astype(np.float32).ravel())
+    mesh.attributes["scale"].data.foreach_set("vector", np.asarray(scales, dtype=np.float32).ravel())
+    mesh.update()
+
+def get_instance_histories(joints, materials, clothed):
+    """
+    Instancing points of the joints and bones of all people.
+    
+    Returns
+    -------
+    materials: template materials of `create_instancing_node_group`
+    instance_index: (points, ) template of each point
+    positions, axis_angles, scales: (frames, points, 3 or 4) histories
+    """
+    bones = Bones(joints)
+    person_materials = materials
+    materials = list(dict.fromkeys(list(materials) + (["Skin", "Gray"] if clothed else [])))
+    frame_num = bones.frames
+    num_spheres = len(bones.sphere_radii)
+    num_cylinders = len(bones.cylinder_radii)
+    
+    # Spheres then cylinders, as (frames, points, ...) histories
+    positions = np.concatenate([bones.sphere_positions, bones.cylinder_positions]).transpose(1, 0, 2)
+    axis_angles = np.concatenate([
+        np.broadcast_to(np.array([0, 1, 0, 0], dtype=np.float32), (num_spheres, frame_num, 4)),
+        bones.cylinder_axis_angles,
+    ]).transpose(1, 0, 2)
+    cylinder_radii = bones.cylinder_radii[:, None, None]
+    scales = np.concatenate([
+        np.broadcast_to(bones.sphere_radii[:, None, None], (num_spheres, frame_num, 3)),
+        bones.cylinder_scales * np.concatenate([cylinder_radii, cylinder_radii, np.ones_like(cylinder_radii)], axis=2),
+    ]).transpose(1, 0, 2)
+    color_ids = np.concatenate([bones.sphere_color_ids, bones.cylinder_color_ids])
+    person_ids = np.concatenate([bones.sphere_person_ids, bones.cylinder_person_ids])
+    shapes = np.repeat([0, 1], [num_spheres, num_cylinders])
+    material_index = np.array([
+        materials.index(primitive_material(cid, person_materials[person], clothed))
+        for cid, person in zip(color_ids, person_ids)
+    ])
+    instance_index = (shapes * len(materials) + material_index).astype(np.int32)
+    return materials, instance_index, positions, axis_angles, scales
+
+def setup_joints_and_bones_instanced(joints, materials, clothed, name="Bones", upsample=2):
+    """
+    Same joints and bones as `setup_joints_and_bones` in a single object for all people.
+    Every sphere and cylinder is a point of a mesh instanced with Geometry Nodes,
+    points are moved by the frame change handler.
+    """
+    materials, instance_index, positions, axis_angles, scales = get_instance_histories(joints, materials, clothed)
+    
+    mesh = bpy.data.meshes.new(f"{name}_points")
+    mesh.vertices.add(len(instance_index))
+    mesh.attributes.new("instance_index", 'INT', 'POINT').data.foreach_set("value", instance_index)
+    mesh.attributes.new("rotation", 'FLOAT_VECTOR', 'POINT')
+    mesh.attributes.new("scale", 'FLOAT_VECTOR', 'POINT')
+    set_instance_attributes(mesh, positions[0], axis_angles[0], scales[0])
+    
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.collection.objects.link(obj)
+    modifier = obj.modifiers.new("Instances", 'NODES')
+    modifier.node_group = create_instancing_node_group(f"{name}_instancing", materials)
+    
+    instance_animations.append((mesh, positions, axis_angles, scales, upsample))
+    register_mesh_animations()
+    return obj
+
+def bind_joints_and_bones_instanced(obj, joints, materials, clothed, upsample=2):
+    """Drive the instancing points of `obj` from a saved scene with `joints`"""
+    _, _, positions, axis_angles, scales = get_instance_histories(joints, materials, clothed)
+    instance_animations.append((obj.data, positions, axis_angles, scales, upsample))
+    register_mesh_animations()
@@ -0,0 +1,177 @@
+"""
+Render-time profiling of render.py jobs, enabled with --profile.
+
+Phases record their wall time, the resident memory of the Blender process at
+their start and end and how much they raised its peak, render progress lines ("Fra:") give the render time of every
+frame, and object and keyframe counts are taken before rendering. The report
+of a render mode is written as JSON next to its output video.
+"""
+
+import bpy
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is left out
+    resource = None
+
+# Fra:12 Mem:210.36M (Peak 260.01M) | Time:00:01.52 | ...
+FRAME_PATTERN = re.compile(r"Fra:(\d+) .*?Time:([\d:.]+)")
+
+# Profile of the running job, None when profiling is off
+active_profile = None
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def current_rss_mb():
+    """Resident memory of this process in MB, None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+def parse_render_time(text):
+    """Seconds of a Blender time like 01:02.35 or 1:01:02.35"""
+    seconds = 0.0
+    for part in text.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def scene_counts():
+    """Objects, mesh data and keyframes of the scene to render"""
+    # Data left by objects of a previous render mode is not counted
+    meshes = [mesh for mesh in bpy.data.meshes if mesh.users]
+    actions = [action for action in bpy.data.actions if action.users]
+    return {
+        "objects": len(bpy.data.objects),
+        "meshes": len(meshes),
+        "vertices": sum(len(mesh.vertices) for mesh in meshes),
+        "actions": len(actions),
+        "keyframes": sum(len(fcurve.keyframe_points) for action in actions for fcurve in action.fcurves),
+    }
+
+class RenderProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.mode = None
+        # Phases of the job, `mode` is None for phases shared by every render mode
+        self.phases = []
+        # Render seconds of each frame, by camera
+        self.frames = {}
+        self.counts = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        rss_start, peak_start = current_rss_mb(), peak_rss_mb()
+        try:
+            yield
+        finally:
+            peak_end = peak_rss_mb()
+            self.phases.append({
+                "name": name,
+                "mode": self.mode,
+                "wall_time": round(time.perf_counter() - start, 4),
+                "rss_start_mb": rss_start,
+                "rss_end_mb": current_rss_mb(),
+                # The peak is process-wide, only its growth belongs to this phase
+                "peak_rss_mb": peak_end,
+                "peak_growth_mb": None if peak_end is None else round(peak_end - peak_start, 1),
+            })
+
+    def record_progress(self, line, camera):
+        match = FRAME_PATTERN.search(line)
+        if match:
+            # Progress lines of a frame report the time elapsed so far, the last one is kept
+            self.frames.setdefault(camera, {})[int(match.group(1))] = parse_render_time(match.group(2))
+
+    def report(self, video_path):
+        scene = bpy.context.scene
+        frames = {}
+        for camera, times in self.frames.items():
+            values = list(times.values())
+            frames[camera] = {
+                "count": len(values),
+                "total": round(sum(values), 3),
+                "mean": round(sum(values) / len(values), 3),
+                "max": round(max(values), 3),
+                "times": {str(frame): seconds for frame, seconds in sorted(times.items())},
+            }
+        return {
+            "video_path": str(video_path),
+            "mode": self.mode,
+            "blender_version": bpy.app.version_string,
+            "engine": scene.render.engine,
+            "resolution": [scene.render.resolution_x, scene.render.resolution_y, scene.render.resolution_percentage],
+            "frame_range": [scene.frame_start, scene.frame_end],
+            "wall_time": round(time.perf_counter() - self.start, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "phases": [phase for phase in self.phases if phase["mode"] in (None, self.mode)],
+            "counts": self.counts,
+            "frames": frames,
+        }
+
+def start_profile(enabled):
+    """Profile the job starting now, or turn profiling off"""
+    global active_profile
+    active_profile = RenderProfile() if enabled else None
+    return active_profile
+
+def start_mode(mode):
+    """Following phases, frames and counts belong to render mode `mode`"""
+    if active_profile is not None:
+        active_profile.mode = mode
+        active_profile.frames = {}
+        active_profile.counts = {}
+
+def record_counts():
+    """Count the objects and keyframes of the scene before it is rendered"""
+    if active_profile is not None:
+        active_profile.counts = scene_counts()
+
+@contextmanager
+def phase(name):
+    """Time a phase of the job, does nothing when profiling is off"""
+    if active_profile is None:
+        yield
+        return
+    with active_profile.phase(name):
+        yield
+
+def record_progress(line, camera):
+    """Parse a render progress line of `camera`"""
+    if active_profile is not None:
+        active_profile.record_progress(line, camera)
+
+def get_report_path(video_path, cameras, frames=None):
+    """
+    Report of the `cameras` of `video_path`, e.g. <video>_cam00_cam01_profile.json,
+    parallel workers of a video render different cameras or `frames` ranges
+    """
+    suffix = "_".join(cameras)
+    if frames is not None:
+        suffix += f"_{frames[0]:04d}-{frames[1]:04d}"
+    return f"{video_path}_{suffix}_profile.json"
+
+def write_report(video_path, cameras, frames=None):
+    """Write the report of the current render mode next to `video_path`"""
+    if active_profile is None:
+        return
+    report_path = get_report_path(video_path, cameras, frames)
+    with open(report_path, "w") as f:
+        json.dump(active_profile.report(video_path), f, indent=2)
+    print(f"Saved profile to {report_path}")
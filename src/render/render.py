@@ -12,128 +12,267 @@ if script_dir not in sys.path:
 from render.utils import *
 from render.camera import *
 from render.prim import *
+from render.profiling import phase, start_profile, start_mode, record_counts, write_report
+from preprocess.store import load_intermediate
+from preprocess.topology import load_hand_faces
+from preprocess.pc2 import get_pc2_path
 
-def parse_arguments():
+def parse_arguments(argv=None):
     # Get all arguments after "--"
-    argv = sys.argv
-    if "--" in argv:
-        argv = argv[argv.index("--") + 1:]
-    else:
-        argv = []
+    if argv is None:
+        argv = sys.argv
+        if "--" in argv:
+            argv = argv[argv.index("--") + 1:]
+        else:
+            argv = []
 
     # Create argument parser
     parser = argparse.ArgumentParser(description='Render SMPL visualization in Blender')
     parser.add_argument('-i', '--input', required=True, type=str)
-    parser.add_argument('-o', '--output', required=True, type=str)
+    # One output path per render mode
+    parser.add_argument('-o', '--output', required=True, type=str, nargs='+')
     parser.add_argument('-q', '--high', action='store_true')
-    parser.add_argument('-c', '--camera', type=int, default=0)
+    parser.add_argument('-c', '--camera', type=int, nargs='+', default=[0])
     parser.add_argument('-sc', '--scene', type=int, default=0)
     parser.add_argument('-f', '--frame', type=int, default=None)
+    # Shard of the animation frames, rendered as a PNG sequence
+    parser.add_argument('-fs', '--frame_start', type=int, default=None)
+    parser.add_argument('-fe', '--frame_end', type=int, default=None)
     parser.add_argument('-fg', '--figure', action='store_true')
     parser.add_argument('-ff', '--figure_floor', action='store_true')
     parser.add_argument('-ih', '--input_hand', action='store_true')
     parser.add_argument('-cl', '--clothed', action='store_true')
     parser.add_argument('-cb', '--checkerboard', action='store_true')
     parser.add_argument('-z', '--zoom', type=str, choices=[None, '0', '1', '2', '1l', '1r', '2l', '2r'], default=None)
-    parser.add_argument('-m', '--mode', type=str, choices=['output', 'input'], default='output')
+    parser.add_argument('-m', '--mode', type=str, choices=['output', 'input'], nargs='+', default=['output'])
+    parser.add_argument('-pm', '--prim_mode', type=str, choices=['objects', 'instances'], default='objects')
+    # Build the scene and save it to this .blend without rendering
+    parser.add_argument('-sb', '--save_blend', type=str, default=None)
+    # The opened .blend is a scene saved with --save_blend, render it without rebuilding
+    parser.add_argument('-pb', '--prebuilt', action='store_true')
+    parser.add_argument('-mm', '--mesh_mode', type=str, choices=['frames', 'handler', 'cache'], default='handler')
+    # Animation frames per base frame, in-between frames are interpolated
+    parser.add_argument('-u', '--upsample', type=int, choices=[1, 2, 4], default=2)
+    # Write a JSON report of phase times, memory, frame times and scene counts next to each video
+    parser.add_argument('-pr', '--profile', action='store_true')
     
     return parser.parse_args(argv)
 
-def main():
-    args = parse_arguments()
+def setup_sample(data, data_path, render_mode, frame_no, input_hand, clothed, zoom, mesh_mode, prim_mode, prebuilt, upsample=2):
+    """
+    Build the joints, bones and meshes of `render_mode` from intermediate `data`.
+    Objects of a prebuilt scene already exist, only handler data is bound to them again.
+    
+    Returns
+    -------
+    root_loc1, root_loc2: (frames, 3) root joints the cameras follow
+    hand_verts: hand vertices of both people, used for zoom
+    """
+    with phase("load_data"):
+        obj_verts = data["obj_verts"]
+        obj_faces = data["obj_faces"]
+        hand_left_faces, hand_right_faces = load_hand_faces(data, data_path)
+    
+        p1_joints = data[f"{render_mode}_p1_joints"]
+        p2_joints = data[f"{render_mode}_p2_joints"]
+        p1_hand_left_key = f"{render_mode}_p1_hand_left_verts"
+        p1_hand_right_key = f"{render_mode}_p1_hand_right_verts"
+        p2_hand_left_key = f"{render_mode}_p2_hand_left_verts"
+        p2_hand_right_key = f"{render_mode}_p2_hand_right_verts"
+        p1_hand_left_verts = data[p1_hand_left_key]
+        p1_hand_right_verts = data[p1_hand_right_key]
+        p2_hand_left_verts = data[p2_hand_left_key]
+        p2_hand_right_verts = data[p2_hand_right_key]
+    
+    with phase("convert_coords"):
+        if render_mode == "input" and input_hand:
+            p1_joints = p1_joints[:, :22]
+            p2_joints = p2_joints[:, :22]
+    
+        p1_joints = convert_to_blender_coord(p1_joints)
+        p2_joints = convert_to_blender_coord(p2_joints)
+    
+        root_loc1 = p1_joints[:, 0]
+        root_loc2 = p2_joints[:, 0]
+    
+        idx = 0
+        if frame_no is not None:
+            idx = frame_no - 1
+        
+            p1_joints = p1_joints[idx:idx+1]
+            p2_joints = p2_joints[idx:idx+1]
+            p1_hand_left_verts = p1_hand_left_verts[idx:idx+1]
+            p1_hand_right_verts = p1_hand_right_verts[idx:idx+1]
+            p2_hand_left_verts = p2_hand_left_verts[idx:idx+1]
+            p2_hand_right_verts = p2_hand_right_verts[idx:idx+1]
+            obj_verts = obj_verts[idx:idx+1]
+    
+        # Mesh Cache modifiers read vertices from the PC2 files and the frame meshes of a prebuilt
+        # scene were saved with it, hand vertices are then only needed for zoom. Converting copies
+        # the memory-mapped sequences, so they are only read when used.
+        uses_verts = mesh_mode == "handler" or (mesh_mode == "frames" and not prebuilt)
+        if uses_verts:
+            obj_verts = convert_to_blender_coord(obj_verts)
+        if uses_verts or zoom:
+            p1_hand_left_verts = convert_to_blender_coord(p1_hand_left_verts)
+            p1_hand_right_verts = convert_to_blender_coord(p1_hand_right_verts)
+            p2_hand_left_verts = convert_to_blender_coord(p2_hand_left_verts)
+            p2_hand_right_verts = convert_to_blender_coord(p2_hand_right_verts)
+    
+    print("Preparing objects...")
+    with phase("joints_and_bones"):
+        # Joints and bones of both people are built in one batched pass
+        joints = np.stack([p1_joints, p2_joints])
+        bone_materials = ["Red_soft", "Blue_soft"]
+        if prim_mode == "instances":
+            # One instancing point cloud for all people
+            if prebuilt:
+                bind_joints_and_bones_instanced(bpy.data.objects["Bones"], joints, bone_materials, clothed, upsample)
+            else:
+                setup_joints_and_bones_instanced(joints, bone_materials, clothed, "Bones", upsample)
+        elif not prebuilt:
+            # One object per joint sphere and bone cylinder
+            setup_joints_and_bones(joints, bone_materials, clothed, upsample)
+    
+    meshes = [("obj_verts", obj_verts, obj_faces, "Dark_Gray", "Object")]
+    if render_mode == "output" or (render_mode == "input" and input_hand):
+        p1_hand_mat = "Skin" if clothed else "Red"
+        p2_hand_mat = "Skin" if clothed else "Blue"
+        meshes += [
+            (p1_hand_left_key, p1_hand_left_verts, hand_left_faces, p1_hand_mat, "P1_Hand_Left"),
+            (p1_hand_right_key, p1_hand_right_verts, hand_right_faces, p1_hand_mat, "P1_Hand_Right"),
+            (p2_hand_left_key, p2_hand_left_verts, hand_left_faces, p2_hand_mat, "P2_Hand_Left"),
+            (p2_hand_right_key, p2_hand_right_verts, hand_right_faces, p2_hand_mat, "P2_Hand_Right"),
+        ]
+    
+    with phase("meshes"):
+        for key, verts, faces, material, name in meshes:
+            if prebuilt:
+                # Objects were saved with the scene, handlers need their vertex data again
+                if mesh_mode == "handler":
+                    bind_mesh_animation(bpy.data.objects[name], verts, upsample)
+            elif mesh_mode == "cache":
+                # One mesh per actor, vertices streamed from the PC2 file written during preprocessing
+                pc2_path = get_pc2_path(data_path, key)
+                if not pc2_path.exists():
+                    raise FileNotFoundError(f"{pc2_path} not found, preprocess with PC2 export first")
+                setup_mesh_cache(pc2_path, faces, material, name, idx, upsample)
+            elif mesh_mode == "handler":
+                # One mesh per actor, vertices updated on frame change
+                setup_mesh_animation(verts, faces, material, name, upsample)
+            else:
+                # One mesh object per animation frame
+                setup_mesh_keyframes(verts, faces, material, upsample)
+        
+    print("Objects setup complete")
+    hand_verts = (p1_hand_left_verts, p1_hand_right_verts, p2_hand_left_verts, p2_hand_right_verts)
+    return root_loc1, root_loc2, hand_verts
+
+def run_job(args):
+    """Build the scene for parsed render.py `args` and render it, or save it with --save_blend"""
     data_path = args.input
-    video_path = args.output
+    video_paths = args.output
     render_high = args.high
     camera_no = args.camera
     scene_no = args.scene
     frame_no = args.frame
-    render_mode = args.mode
+    frame_start = args.frame_start
+    frame_end = args.frame_end
+    render_modes = args.mode
     figure = args.figure
     figure_floor = args.figure_floor
     input_hand = args.input_hand
     clothed = args.clothed
     checkerboard = args.checkerboard
     zoom = args.zoom
+    mesh_mode = args.mesh_mode
+    prim_mode = args.prim_mode
+    upsample = args.upsample
+    save_blend = args.save_blend
+    prebuilt = args.prebuilt
+    start_profile(args.profile)
+    
+    if len(video_paths) != len(render_modes):
+        raise ValueError(f"Got {len(video_paths)} output paths for {len(render_modes)} render modes")
+    if (save_blend or prebuilt) and len(render_modes) > 1:
+        raise ValueError("A saved scene holds a single render mode")
     
-    # Load scene and setup
-    cleanup_existing_objects()
-    setup_render_settings(render_high)
-    setup_background_scene(scene_no)
+    # Load scene and setup, a prebuilt scene was set up before it was saved
+    clear_mesh_animations()
+    if not prebuilt:
+        with phase("setup_scene"):
+            cleanup_existing_objects()
+            setup_render_settings(render_high)
+            setup_background_scene(scene_no)
+            setup_floor_render(figure, figure_floor, checkerboard)
     
     # Prepare render data
-    data = np.load(data_path)
-    
-    obj_verts = data["obj_verts"]
-    obj_faces = data["obj_faces"]
-    num_frames = data["num_frames"]
-    hand_left_faces = data["hand_left_faces"]
-    hand_right_faces = data["hand_right_faces"]
-    
-    p1_joints = data[f"{render_mode}_p1_joints"]
-    p2_joints = data[f"{render_mode}_p2_joints"]
-    p1_hand_left_verts = data[f"{render_mode}_p1_hand_left_verts"]
-    p1_hand_right_verts = data[f"{render_mode}_p1_hand_right_verts"]
-    p2_hand_left_verts = data[f"{render_mode}_p2_hand_left_verts"]
-    p2_hand_right_verts = data[f"{render_mode}_p2_hand_right_verts"]
-    
-    if render_mode == "input" and input_hand:
-        p1_joints = p1_joints[:, :22]
-        p2_joints = p2_joints[:, :22]
-    
-    p1_joints = convert_to_blender_coord(p1_joints)
-    p2_joints = convert_to_blender_coord(p2_joints)
-    obj_verts = convert_to_blender_coord(obj_verts)
-    p1_hand_left_verts = convert_to_blender_coord(p1_hand_left_verts)
-    p1_hand_right_verts = convert_to_blender_coord(p1_hand_right_verts)
-    p2_hand_left_verts = convert_to_blender_coord(p2_hand_left_verts)
-    p2_hand_right_verts = convert_to_blender_coord(p2_hand_right_verts)
-    
-    root_loc1 = p1_joints[:, 0]
-    root_loc2 = p2_joints[:, 0]
+    # Arrays are memory-mapped for directory stores, so only sliced frames are read
+    with phase("load_intermediate"):
+        data = load_intermediate(data_path)
+        num_frames = int(data["num_frames"])
     
     # # Create joints and bones
-    anim_frames = num_frames*2-1
+    anim_frames = get_anim_frames(num_frames, upsample)
     setup_animation_settings(anim_frames)
     
     if frame_no is not None:
         frame_no = max(1, min(int(num_frames), int(frame_no)))
-        idx = frame_no - 1
-
-        p1_joints = p1_joints[idx:idx+1]
-        p2_joints = p2_joints[idx:idx+1]
-        p1_hand_left_verts = p1_hand_left_verts[idx:idx+1]
-        p1_hand_right_verts = p1_hand_right_verts[idx:idx+1]
-        p2_hand_left_verts = p2_hand_left_verts[idx:idx+1]
-        p2_hand_right_verts = p2_hand_right_verts[idx:idx+1]
-        obj_verts = obj_verts[idx:idx+1]
-        num_frames = 1
+    image_sequence = frame_start is not None or frame_end is not None
+    if image_sequence:
+        setup_frame_range(frame_start or 1, frame_end or anim_frames)
     
-    print("Preparing objects...")
-    setup_joints_and_bones(p1_joints, "Red_soft", clothed)
-    setup_joints_and_bones(p2_joints, "Blue_soft", clothed)
-    setup_mesh_keyframes(obj_verts, obj_faces, "Dark_Gray")
+    # Cameras are placed relative to the initial camera, which rendering a mode moves
+    camera = bpy.context.scene.camera
+    initial_camera = (camera.location.copy(), camera.rotation_euler.copy())
     
-    if render_mode == "output" or (render_mode == "input" and input_hand):
-        p1_hand_mat = "Skin" if clothed else "Red"
-        p2_hand_mat = "Skin" if clothed else "Blue"
-        setup_mesh_keyframes(p1_hand_left_verts, hand_left_faces, p1_hand_mat)
-        setup_mesh_keyframes(p1_hand_right_verts, hand_right_faces, p1_hand_mat)
-        setup_mesh_keyframes(p2_hand_left_verts, hand_left_faces, p2_hand_mat)
-        setup_mesh_keyframes(p2_hand_right_verts, hand_right_faces, p2_hand_mat)
+    # Render modes are built and rendered back to back in the loaded scene
+    for i, (render_mode, video_path) in enumerate(zip(render_modes, video_paths)):
+        scene_objects = set(bpy.data.objects)
+        start_mode(render_mode)
+        root_loc1, root_loc2, hand_verts = setup_sample(
+            data, data_path, render_mode, frame_no, input_hand, clothed, zoom, mesh_mode, prim_mode, prebuilt, upsample
+        )
         
-    print("Objects setup complete")
-    
-    setup_floor_render(figure, figure_floor, checkerboard)
-    # Render animation or a single frame
-    look_at = None
-    if zoom:
-        look_at = calculate_zoom_path(p1_hand_left_verts, p1_hand_right_verts, p2_hand_left_verts, p2_hand_right_verts, zoom)
-    camera_settings = prepare_camera_settings(root_loc1, root_loc2, camera_no, look_at)
+        if save_blend:
+            with phase("save_blend"):
+                bpy.ops.wm.save_as_mainfile(filepath=os.path.abspath(save_blend), copy=True)
+            print(f"Saved scene to {save_blend}")
+            record_counts()
+            write_report(video_path, ["build"])
+            # Handlers hold mesh data, release them before Blender exits
+            clear_mesh_animations()
+            return
+        
+        # Render animation or a single frame
+        with phase("camera_setup"):
+            camera.location, camera.rotation_euler = initial_camera
+            look_at = None
+            if zoom:
+                look_at = calculate_zoom_path(*hand_verts, zoom)
+            camera_settings = prepare_camera_settings(root_loc1, root_loc2, camera_no, look_at)
+        record_counts()
+        
+        with phase("render"):
+            if frame_no is not None:
+                render_single_frame(video_path, camera_settings, frame_no)
+            else:
+                render_animation(video_path, camera_settings, image_sequence, upsample)
+        # Workers of a video render different cameras or frame ranges, each writes its own report
+        frames = None
+        if frame_no is not None:
+            frames = (frame_no, frame_no)
+        elif image_sequence:
+            frames = (bpy.context.scene.frame_start, bpy.context.scene.frame_end)
+        write_report(video_path, [camera_setting['text'] for camera_setting in camera_settings], frames)
+        clear_mesh_animations()
+        
+        if i < len(render_modes) - 1:
+            # Drop the objects of this mode before building the next one
+            remove_objects(set(bpy.data.objects) - scene_objects)
     
-    if frame_no is not None:
-        render_single_frame(video_path, camera_settings, frame_no)
-    else:
-        render_animation(video_path, camera_settings)
+def main():
+    run_job(parse_arguments())
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
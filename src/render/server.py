@@ -0,0 +1,168 @@
+"""
+Persistent render server.
+
+Runs render.py jobs in one long-lived Blender process, so Blender startup and
+the scene.blend load (HDRIs, furniture, materials) are paid once:
+
+    blender blender/scene.blend --background --python src/render/server.py -- --port 5577
+
+Clients send one JSON line {"argv": [render.py arguments]} over a local TCP
+socket and get one JSON line back when the job is done: {"ok": true},
+{"ok": false, "error": traceback} or {"busy": true} if a job is running.
+{"shutdown": true} stops the server. See render/client.py.
+
+Objects created by a job are removed afterwards and the scene settings jobs
+change (camera, floor, sun, scene collections, image format) are restored, the background scene stays loaded.
+"""
+
+import bpy
+import argparse
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import traceback
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+script_dir = os.path.dirname(script_dir)
+if script_dir not in sys.path:
+    sys.path.append(script_dir)
+
+from render.render import parse_arguments, run_job
+from render.utils import remove_objects
+from render.prim import clear_mesh_animations
+from render.client import LISTENING_MESSAGE
+
+def read_message(conn):
+    """One JSON line from `conn`"""
+    with conn.makefile("r", encoding="utf-8") as f:
+        return json.loads(f.readline())
+
+def send_message(conn, message):
+    conn.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+def capture_scene_state():
+    """Settings of the loaded scene that render jobs change"""
+    scene = bpy.context.scene
+    camera = scene.camera
+    state = {
+        "image_settings": (scene.render.image_settings.file_format, scene.render.image_settings.color_mode),
+        "camera": (camera.location.copy(), camera.rotation_euler.copy(), camera.data.angle, camera.animation_data is not None),
+    }
+    scenes_collection = bpy.data.collections.get('Scenes')
+    if scenes_collection:
+        # setup_background_scene shows only the requested scene, and leaves them as is for scene 0
+        state["scenes"] = [(collection, collection.hide_render) for collection in scenes_collection.children]
+    sun = bpy.data.objects.get('Sun')
+    if sun:
+        state["sun"] = sun.rotation_euler.copy()
+    floor_obj = bpy.data.objects.get('Floor')
+    if floor_obj:
+        roughness = [
+            (node, node.inputs['Roughness'].default_value)
+            for material in floor_obj.data.materials if material and material.use_nodes
+            for node in material.node_tree.nodes if node.type == 'BSDF_PRINCIPLED'
+        ]
+        catcher = {attr: getattr(floor_obj, attr) for attr in ('is_shadow_catcher', 'use_shadow_catcher') if hasattr(floor_obj, attr)}
+        state["floor"] = (floor_obj.hide_render, floor_obj.hide_viewport, list(floor_obj.data.materials), roughness, catcher)
+    return state
+
+def restore_scene_state(state):
+    scene = bpy.context.scene
+    # Available color modes depend on the file format
+    scene.render.image_settings.file_format, scene.render.image_settings.color_mode = state["image_settings"]
+    camera = scene.camera
+    location, rotation, angle, animated = state["camera"]
+    if not animated:
+        # Zoom keyframes the camera rotation
+        camera.animation_data_clear()
+    camera.location, camera.rotation_euler, camera.data.angle = location, rotation, angle
+    for collection, hide_render in state.get("scenes", []):
+        collection.hide_render = hide_render
+    if "sun" in state:
+        bpy.data.objects['Sun'].rotation_euler = state["sun"]
+    if "floor" in state:
+        floor_obj = bpy.data.objects['Floor']
+        hide_render, hide_viewport, materials, roughness, catcher = state["floor"]
+        floor_obj.hide_render, floor_obj.hide_viewport = hide_render, hide_viewport
+        floor_obj.data.materials.clear()
+        for material in materials:
+            floor_obj.data.materials.append(material)
+        for node, value in roughness:
+            node.inputs['Roughness'].default_value = value
+        for attr, value in catcher.items():
+            setattr(floor_obj, attr, value)
+
+def run_server_job(argv, state):
+    """Run one render.py job, then reset the scene for the next one"""
+    scene_objects = set(bpy.data.objects)
+    try:
+        run_job(parse_arguments(argv))
+    finally:
+        clear_mesh_animations()
+        remove_objects(set(bpy.data.objects) - scene_objects)
+        restore_scene_state(state)
+        bpy.data.orphans_purge(do_recursive=True)
+
+def accept_jobs(server, jobs, busy):
+    """Queue jobs for the main thread, Blender data can only be used there"""
+    while True:
+        conn, _ = server.accept()
+        try:
+            message = read_message(conn)
+        except (OSError, ValueError):
+            conn.close()
+            continue
+        if busy.is_set() and "shutdown" not in message:
+            send_message(conn, {"busy": True})
+            conn.close()
+            continue
+        busy.set()
+        jobs.put((conn, message))
+
+def serve(port, host="127.0.0.1"):
+    state = capture_scene_state()
+    server = socket.create_server((host, port))
+    jobs, busy = queue.Queue(), threading.Event()
+    threading.Thread(target=accept_jobs, args=(server, jobs, busy), daemon=True).start()
+    # Port 0 binds a free port, clients learn it from this line
+    print(LISTENING_MESSAGE.format(host=host, port=server.getsockname()[1]), flush=True)
+
+    while True:
+        conn, message = jobs.get()
+        if message.get("shutdown"):
+            send_message(conn, {"ok": True})
+            conn.close()
+            break
+        argv = message["argv"]
+        print(f"Job: {' '.join(argv)}", flush=True)
+        try:
+            run_server_job(argv, state)
+            reply = {"ok": True}
+        except BaseException as e:
+            if isinstance(e, KeyboardInterrupt):
+                raise
+            traceback.print_exc()
+            reply = {"ok": False, "error": traceback.format_exc()}
+        sys.stdout.flush()
+        try:
+            send_message(conn, reply)
+        except OSError:
+            pass
+        conn.close()
+        busy.clear()
+    server.close()
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(description='Serve render.py jobs from a persistent Blender process')
+    # 0 picks a free port, see the listening line printed at startup
+    parser.add_argument('-p', '--port', type=int, default=0)
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    args = parser.parse_args(argv)
+    serve(args.port, args.host)
+
+if __name__ == "__main__":
+    main()
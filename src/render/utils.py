@@ -8,6 +8,8 @@ from contextlib import contextmanager
 import numpy as np
 import math
 
+from render.profiling import record_progress
+
 @contextmanager
 def stdout_redirected(keyword=None, on_match=None):
     """
@@ -42,6 +44,35 @@ def stdout_redirected(keyword=None, on_match=None):
         thread.join()
         os.close(saved_fd)
 
+def insert_keyframes(obj, data_path, frames, values, group="Object Transforms"):
+    """
+    Keyframe every channel of `data_path` at once, replacing existing keys.
+    Writes the fcurve points with one foreach_set per channel instead of a
+    keyframe_insert call per frame.
+
+    frames: (N,) frame numbers
+    values: (N, C) channel values
+    """
+    values = np.asarray(values, dtype=np.float32).reshape(len(frames), -1)
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    if obj.animation_data.action is None:
+        obj.animation_data.action = bpy.data.actions.new(f"{obj.name}Action")
+    fcurves = obj.animation_data.action.fcurves
+    
+    co = np.empty((len(frames), 2), dtype=np.float32)
+    co[:, 0] = frames
+    for index in range(values.shape[1]):
+        fcurve = fcurves.find(data_path, index=index)
+        if fcurve is None:
+            fcurve = fcurves.new(data_path, index=index, action_group=group)
+        else:
+            fcurve.keyframe_points.clear()
+        co[:, 1] = values[:, index]
+        fcurve.keyframe_points.add(len(frames))
+        fcurve.keyframe_points.foreach_set("co", co.ravel())
+        fcurve.update()
+
 def convert_to_blender_coord(x):
     new_x = x.copy()
     new_x[..., 1], new_x[..., 2] = x[..., 2], x[..., 1]
@@ -54,6 +85,15 @@ def cleanup_existing_objects():
         for obj in sample_collection.objects:
             bpy.data.objects.remove(obj, do_unlink=True)
 
+def remove_objects(objects):
+    """Remove `objects` and the meshes no other object uses"""
+    meshes = {obj.data for obj in objects if obj.type == 'MESH'}
+    for obj in objects:
+        bpy.data.objects.remove(obj, do_unlink=True)
+    for mesh in meshes:
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+
 def setup_background_scene(scene_no):
     """Setup background scene"""
     scenes_collection = bpy.data.collections.get('Scenes')
@@ -75,11 +115,15 @@ def setup_background_scene(scene_no):
         background_objects.append(floor_obj)
 
     for obj in background_objects:
+        # A render server keeps the scene between jobs, transforms are only applied once
+        if obj.get("transform_applied"):
+            continue
         bpy.context.scene.cursor.location = (0, 0, 0)
         with bpy.context.temp_override(selected_editable_objects=[obj]):
             bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
             bpy.ops.object.origin_set(type='ORIGIN_CURSOR')
-    
+        obj["transform_applied"] = True
+
     return background_objects
 
 def setup_render_settings(render_high):
@@ -142,7 +186,7 @@ def setup_animation_settings(num_frames):
     bpy.context.scene.frame_start = 1
     bpy.context.scene.frame_end = num_frames
 
-def setup_camera_setting(camera_setting):
+def setup_camera_setting(camera_setting, upsample=2):
     camera = bpy.context.scene.camera
     camera.location = camera_setting['cam_location']
     
@@ -152,12 +196,12 @@ def setup_camera_setting(camera_setting):
         camera.data.angle = 0.07
         
         # Animate camera to look at look_at point for each frame
-        # look_at is (T, 3) location sequence
+        # look_at is (T, 3) location sequence of the base frames
         num_frames = look_at.shape[0]
         cam_location_vec = mathutils.Vector(camera_setting['cam_location'])
+        cam_rotations = np.empty((num_frames, 3), dtype=np.float32)
         
         for frame in range(num_frames):
-            anim_frame = frame * 2 + 1
             target_point = mathutils.Vector(look_at[frame])
             
             # Calculate direction from camera to target
@@ -166,10 +210,10 @@ def setup_camera_setting(camera_setting):
             
             # Calculate rotation to look at target
             # Use track_quat to get rotation that points -Z axis at target
-            cam_rotation = direction.to_track_quat('-Z', 'Y').to_euler()
-            
-            camera.rotation_euler = cam_rotation
-            camera.keyframe_insert(data_path="rotation_euler", frame=anim_frame)
+            cam_rotations[frame] = direction.to_track_quat('-Z', 'Y').to_euler()
+        
+        camera.rotation_euler = cam_rotations[0]
+        insert_keyframes(camera, "rotation_euler", np.arange(num_frames) * upsample + 1, cam_rotations)
     else:
         # Static camera rotation
         camera.rotation_euler = camera_setting['cam_rotation']
@@ -226,19 +270,37 @@ def setup_floor_render(figure, figure_floor, checkerboard):
             floor_obj.data.materials.clear()
             floor_obj.data.materials.append(checkerboard_material)
         
-def render_animation(video_path, camera_settings):
-    """Render animation from different camera angles"""
+def setup_frame_range(frame_start, frame_end):
+    """Render frames `frame_start`..`frame_end` of the animation as a PNG sequence"""
+    scene = bpy.context.scene
+    scene.frame_start = max(scene.frame_start, frame_start)
+    scene.frame_end = min(scene.frame_end, frame_end)
+    scene.render.image_settings.file_format = 'PNG'
+
+def get_frames_dir(cam_video_path):
+    """PNG sequences of a camera are written to <video>_<cam>_frames/0001.png, ..."""
+    return f"{cam_video_path}_frames"
+
+def show_progress(line, cam_text):
+    """Progress line of a render to print in place, its frame time is recorded when profiling"""
+    record_progress(line, cam_text)
+    return line[:-1].encode()
+
+def render_animation(video_path, camera_settings, image_sequence=False, upsample=2):
+    """Render animation from different camera angles, base frames `upsample` frames apart"""
     for camera_setting in camera_settings:
         cam_text = camera_setting['text']
-        video_path = video_path + f"_{cam_text}"
-        bpy.context.scene.render.filepath = video_path
-        setup_camera_setting(camera_setting)
+        cam_video_path = video_path + f"_{cam_text}"
+        if image_sequence:
+            cam_video_path = get_frames_dir(cam_video_path) + os.sep
+        bpy.context.scene.render.filepath = cam_video_path
+        setup_camera_setting(camera_setting, upsample)
         
         print(f"Rendering animation for {cam_text}...")
-        with stdout_redirected(keyword="Fra:", on_match=lambda line: line[:-1].encode()):
+        with stdout_redirected(keyword="Fra:", on_match=lambda line: show_progress(line, cam_text)):
             bpy.ops.render.render(animation=True)
         print()
-        print(f"Saved to {video_path}")
+        print(f"Saved to {cam_video_path}")
 
 def render_single_frame(output_path, camera_settings, frame_no):
     """Render a single frame (still image) from different camera angles"""
@@ -253,6 +315,6 @@ def render_single_frame(output_path, camera_settings, frame_no):
         setup_camera_setting(camera_setting)
         
         print(f"Rendering frame {frame_no} for {cam_text}...")
-        with stdout_redirected(keyword="Fra:", on_match=lambda line: line[:-1].encode()):
+        with stdout_redirected(keyword="Fra:", on_match=lambda line: show_progress(line, cam_text)):
             bpy.ops.render.render(animation=False, write_still=True)
         print(f"Saved to {filepath}")
\ No newline at end of file